@@ -0,0 +1,148 @@
+# batch mode of databaseWordCounter.py: several named configurations (wordsWeWant, filter list edits, filterNums) counted
+# from one tokenization of the corpus
+# the corpus is tokenized with the loosest filters of all configurations, each configuration then picks its words
+# from the word ids with a mask over the vocabulary (and matches its phrases on the ids), in one shared pass over the corpus
+import re
+import json
+import hashlib
+import numpy as np
+from tokenizer import Tokenizer, stripWord
+from phraseMatcher import parseTerms, termName
+from yearWordMatrix import YearWordCounts
+
+# settings a configuration can have, the ones it leaves out are taken from databaseWordCounter.py
+# wordsToFilterList replaces the filter list, addToFilterList/removeFromFilterList (comma separated words) edit it
+configKeys = ("wordsWeWant", "filterNums", "wordsToFilterList", "addToFilterList", "removeFromFilterList")
+
+# configuration names are used as folder names in Output
+configNamePattern = re.compile(r"[\w.-]+")
+
+# settings of one run of databaseWordCounter.py, also used for its single (unnamed) configuration outside batch mode
+class BatchConfig:
+    # settings: the configuration's own settings, defaults: values for the keys of configKeys it leaves out
+    # name is None for the single configuration of a run without --batch
+    def __init__(self, name, settings, defaults):
+        self.name = name
+        self.ownSettings = settings
+        settings = {**defaults, **settings}
+        self.filterNums = settings["filterNums"]
+
+        # filter list with the edits
+        wordListTokenizer = Tokenizer(self.filterNums)
+        wordsWeDontWant = set(wordListTokenizer.tokenize(settings["wordsToFilterList"]))
+        wordsWeDontWant |= set(wordListTokenizer.tokenize(settings.get("addToFilterList") or ""))
+        wordsWeDontWant -= set(wordListTokenizer.tokenize(settings.get("removeFromFilterList") or ""))
+        self.wordsWeDontWant = wordsWeDontWant
+        self.tokenizer = Tokenizer(self.filterNums, wordsWeDontWant)
+
+        self.terms = None
+        self.wordsWeWant = None
+        if settings["wordsWeWant"] is not None:
+            #each comma separated part is a term, a part with several words is counted as a phrase
+            self.terms = parseTerms(settings["wordsWeWant"], self.filterNums, wordsWeDontWant)
+            self.wordsWeWant = set(termName(term) for term in self.terms)
+            for term in self.terms:
+                if len(term) == 1 and term[0] in wordsWeDontWant:
+                    inConfig = f" (configuration '{name}')" if name is not None else ""
+                    raise Exception(f"Cant have word in both wordsWeWant and wordsWeDontWant: '{term[0]}'{inConfig}")
+
+    # words of phrases (these are kept in the tokenized corpus even if filtered out, to find the phrases)
+    def phraseWords(self):
+        return set(word for term in self.terms or () if len(term) > 1 for word in term)
+
+# configurations from a json file of {"name": {settings}, ...}, defaults: settings of databaseWordCounter.py for the keys a configuration leaves out
+def readConfigs(path, defaults):
+    with open(path, encoding="utf-8") as f:
+        fileConfigs = json.load(f)
+    if not isinstance(fileConfigs, dict) or not fileConfigs:
+        raise Exception(f"{path} must hold a json object of configuration name -> settings")
+
+    configs = []
+    for name, settings in fileConfigs.items():
+        if not configNamePattern.fullmatch(name):
+            raise Exception(f"Configuration name '{name}' can only have letters, digits, '_', '.' and '-' (it is used as a folder name)")
+        unknownKeys = set(settings) - set(configKeys)
+        if unknownKeys:
+            raise Exception(f"Unknown settings {sorted(unknownKeys)} in configuration '{name}', expected some of {configKeys}")
+        configs.append(BatchConfig(name, settings, defaults))
+    return configs
+
+# tokenizer for the shared corpus of a batch: keeps every word some configuration keeps (only words all of them
+# filter out are dropped), with phrases it also keeps the chunks in between as the word "" so phrases only match adjacent words
+# tokenizeIds is Tokenizer's with these word ids, its number of words is the number of ids (each configuration counts
+# its own from the ids, see ConfigCounter)
+class BatchTokenizer(Tokenizer):
+    def __init__(self, configs):
+        super().__init__(all(config.filterNums for config in configs), set.intersection(*(config.wordsWeDontWant for config in configs)))
+        self.phraseWords = frozenset(set().union(*(config.phraseWords() for config in configs)))
+        self.keepGaps = bool(self.phraseWords)
+
+    def configHash(self):
+        return hashlib.sha1(json.dumps([super().configHash(), sorted(self.phraseWords), self.keepGaps]).encode()).hexdigest()
+
+    def chunkId(self, chunk):
+        word = stripWord(chunk)
+        if not (self.keepWord(word) or word in self.phraseWords):
+            if not self.keepGaps:
+                return -1
+            word = ""
+        return self.idVocab.setdefault(word, len(self.idVocab))
+
+# counts of one configuration over the shared corpus
+class ConfigCounter:
+    def __init__(self, config, corpus):
+        self.config = config
+        vocab = corpus.vocab
+        # words the configuration keeps (the number of words of a study, and its words if it has no wordsWeWant)
+        self.keep = np.fromiter((config.tokenizer.keepWord(word) for word in vocab), dtype=bool, count=len(vocab))
+
+        if config.terms is None:
+            self.vocab = vocab
+            self.termIds = None
+        else:
+            # terms are counted under their own ids (index in config.terms), a term with a word not in the corpus is never found
+            wordIds = {word: wordId for wordId, word in enumerate(vocab)}
+            self.vocab = [termName(term) for term in config.terms]
+            self.termIds = [None if any(word not in wordIds for word in term) else np.array([wordIds[word] for word in term])
+                            for term in config.terms]
+        self.counts = YearWordCounts(len(self.vocab))
+
+    # positions of each found term in tokens, its length and its id, in the order PhraseMatcher gives them
+    # (by start, a term inside a longer one first)
+    def findTerms(self, tokens, studyOfToken):
+        positions, lengths, termIds = [], [], []
+        for termId, ids in enumerate(self.termIds):
+            if ids is None:
+                continue
+            starts = np.flatnonzero(tokens == ids[0])
+            for i in range(1, len(ids)):
+                starts = starts[starts+i < len(tokens)]
+                starts = starts[(tokens[starts+i] == ids[i]) & (studyOfToken[starts+i] == studyOfToken[starts])]
+            positions.append(starts)
+            lengths.append(np.full(len(starts), len(ids)))
+            termIds.append(np.full(len(starts), termId))
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        positions, lengths, termIds = np.concatenate(positions), np.concatenate(lengths), np.concatenate(termIds)
+        order = np.lexsort((lengths, positions))
+        return positions[order], termIds[order]
+
+    # count a block of studies (see TokenCorpus.iterBlocks), yearIndex: year index of each study of the block
+    def addBlock(self, tokens, studyOfToken, yearIndex):
+        kept = self.keep[tokens]
+        numWords = np.bincount(studyOfToken[kept], minlength=len(yearIndex))
+        if self.termIds is None:
+            self.counts.addMentions(studyOfToken[kept], tokens[kept], yearIndex, numWords)
+        else:
+            positions, termIds = self.findTerms(tokens, studyOfToken)
+            self.counts.addMentions(studyOfToken[positions], termIds, yearIndex, numWords)
+
+# YearWordMatrix of each configuration (same order as configs), from one pass over the corpus tokenized with BatchTokenizer(configs)
+# each matrix is the same as a run of databaseWordCounter.py with that configuration gives
+def countConfigs(corpus, configs, blockTokens = 1000000):
+    years, yearIndex, numStudies = corpus.yearGroups()
+    counters = [ConfigCounter(config, corpus) for config in configs]
+    for start, end, tokens, studyOfToken in corpus.iterBlocks(blockTokens):
+        for counter in counters:
+            counter.addBlock(tokens, studyOfToken, yearIndex[start:end])
+    return [counter.counts.toMatrix(years, numStudies, counter.vocab) for counter in counters]
@@ -0,0 +1,319 @@
+# benchmarks for the slow stages of downloadData.py and databaseWordCounter.py
+# python benchmark.py extraction --xml saved/*.xml   (responses saved with downloadData.py --saveXmlDir)
+# python benchmark.py extraction --synthetic 5000   (generated efetch responses)
+# python benchmark.py parsing --xml saved/*.xml      (efetchParser against the Entrez.read path)
+# python benchmark.py stages --sizes 10000 100000     (each databaseWordCounter.py stage on generated corpora, results in benchmarkResults.json)
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from xml.sax.saxutils import escape
+
+syntheticWords = ("urology prostate cancer bladder kidney stone patient's x-ray renal tumor depression anxiety "
+                  "stress incontinence catheter urethral robotic laparoscopic outcomes cohort résumé naïve").split()
+monthNames = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+
+efetchHeader = ('<?xml version="1.0" ?>\n<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2025//EN" '
+                '"https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_250101.dtd">\n<PubmedArticleSet>\n')
+
+# one PubmedArticle shaped like efetch output, with the cases the extraction has to handle
+# (inline markup, labelled abstract sections, collective authors, missing fields, MedlineDate)
+# date: (year, month, day) publication date to give it instead of a random one (as stubEntrez.py does, so date searches match)
+def syntheticArticle(pmid, date = None):
+    rand = random.Random(pmid)
+    words = lambda n: escape(" ".join(rand.choice(syntheticWords) for _ in range(n)))
+
+    title = f"{words(6)} <i>in vivo</i> {words(3)}"
+    if rand.random() < 0.3:
+        abstract = "".join(f'<AbstractText Label="PART {i}" NlmCategory="METHODS">{words(40)} &lt;5 &amp; more</AbstractText>' for i in range(3))
+    else:
+        abstract = f"<AbstractText>{words(rand.randint(80, 250))}</AbstractText>"
+    abstract = f"<Abstract>{abstract}<CopyrightInformation>c</CopyrightInformation></Abstract>" if rand.random() > 0.1 else ""
+
+    authors = ""
+    for i in range(rand.randint(0, 6)):
+        affiliation = f"<AffiliationInfo><Affiliation>Department {rand.randint(0, 3)}, University</Affiliation></AffiliationInfo>" if rand.random() < 0.7 else ""
+        if rand.random() < 0.1:
+            authors += f'<Author ValidYN="Y"><CollectiveName>Study Group {i}</CollectiveName>{affiliation}</Author>'
+        else:
+            authors += f'<Author ValidYN="Y"><LastName>Last{i}</LastName><ForeName>Fore{i}</ForeName><Initials>F</Initials>{affiliation}</Author>'
+    authors = f'<AuthorList CompleteYN="Y">{authors}</AuthorList>' if authors else ""
+
+    mesh = "".join(f'<MeshHeading><DescriptorName UI="D{i}" MajorTopicYN="N">Mesh Term {i}</DescriptorName></MeshHeading>' for i in range(rand.randint(0, 4)))
+    mesh = f"<MeshHeadingList>{mesh}</MeshHeadingList>" if mesh else ""
+
+    year = rand.randint(1950, 2025)
+    if rand.random() < 0.05:
+        pubDate = f"<MedlineDate>{year} Spring</MedlineDate>"
+    else:
+        pubDate = f"<Year>{year}</Year><Month>{rand.choice(monthNames)}</Month>"
+    if date is not None:
+        pubDate = f"<Year>{date[0]}</Year><Month>{monthNames[date[1]-1]}</Month><Day>{date[2]:02d}</Day>"
+
+    return (f'<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM"><PMID Version="1">{pmid}</PMID>'
+            f'<Article PubModel="Print"><Journal><JournalIssue CitedMedium="Print"><Volume>1</Volume><PubDate>{pubDate}</PubDate></JournalIssue>'
+            f'<Title>Journal {rand.randint(0, 20)}</Title></Journal><ArticleTitle>{title}</ArticleTitle>{abstract}{authors}'
+            f'<Language>eng</Language></Article>{mesh}</MedlineCitation>'
+            f'<PubmedData><PublicationStatus>ppublish</PublicationStatus></PubmedData></PubmedArticle>\n')
+
+# efetch response (bytes) with numArticles synthetic articles
+def syntheticEfetchXml(numArticles, firstPmid = 1000000):
+    articles = "".join(syntheticArticle(pmid) for pmid in range(firstPmid, firstPmid+numArticles))
+    return (efetchHeader + articles + "</PubmedArticleSet>\n").encode()
+
+# records per second of downloadData.extractChunk (parse + extract + write to the store) over efetch responses
+def benchmarkExtraction(xmlResponses):
+    from corpusStore import CorpusWriter
+    from downloadData import extractChunk
+
+    numRecords = 0
+    with tempfile.TemporaryDirectory() as tmpDir:
+        startTime = time.perf_counter()
+        with CorpusWriter(os.path.join(tmpDir, "benchmark.parquet")) as writer:
+            for xml in xmlResponses:
+                numRecords += extractChunk(xml, writer)
+        elapsed = time.perf_counter()-startTime
+
+    return {"records": numRecords, "seconds": elapsed, "records_per_second": numRecords/elapsed}
+
+# compare the streaming efetchParser path to the Entrez.read path: speed, peak memory per response, and whether the rows match
+def benchmarkParsing(xmlResponses):
+    from corpusStore import CorpusWriter, iterBatches
+    from downloadData import extractChunk, extractChunkEntrez
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmpDir:
+        paths = dict()
+        for name, extract in (("entrez_read", extractChunkEntrez), ("efetch_parser", extractChunk)):
+            paths[name] = os.path.join(tmpDir, name + ".parquet")
+            numRecords = 0
+            elapsed = 0.0
+            peakMemory = 0
+            with CorpusWriter(paths[name]) as writer:
+                for xml in xmlResponses:
+                    tracemalloc.start()
+                    startTime = time.perf_counter()
+                    numRecords += extract(xml, writer)
+                    elapsed += time.perf_counter()-startTime
+                    peakMemory = max(peakMemory, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+            results[name] = {"records": numRecords, "seconds": elapsed, "records_per_second": numRecords/elapsed,
+                             "peak_mb_per_response": peakMemory/2**20}
+
+        # fullRecord differs on purpose, affiliations are a set (extractRecord's order is arbitrary)
+        numMismatches = 0
+        for batchA, batchB in zip(iterBatches(paths["entrez_read"]), iterBatches(paths["efetch_parser"])):
+            for column in batchA:
+                if column == "fullRecord":
+                    continue
+                for a, b in zip(batchA[column], batchB[column]):
+                    if column == "Affiliations":
+                        a, b = set(a.split("; ")), set(b.split("; "))
+                    numMismatches += a != b
+        results["mismatched_values"] = numMismatches
+
+    return results
+
+# made up words with a zipf like frequency, plus the filter list (most frequent) and the kinds of chunk the tokenizer has to handle
+syntheticOddTokens = ("patient's", "men's", "x-ray", "covid-19", "(PSA)", "p<0.05", "12.5%", "1990", "12-15", "well-being", "'quoted'",
+                      "o'neil", "résumé", "naïve", "μg", "±", "≥", "ÉCOLE", "-dash-", "n=120", "[1].", "cancer;", "depression,", "anxiety.",
+                      "prostate", "cancer", "borderline", "personality", "disorder")
+
+def syntheticCorpusVocab(rng, size = 50000):
+    import numpy as np
+    from wordsToFilterList import wordsToFilterList
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    madeUp = ["".join(rng.choice(letters, rng.integers(3, 13))) for _ in range(size)]
+    stopWords = [word.strip() for word in wordsToFilterList.split(",") if word.strip()]
+    vocab = np.array(stopWords[:200] + list(syntheticOddTokens) + madeUp + stopWords[200:], dtype=object)
+    weights = 1.0/np.arange(1, len(vocab)+1)
+    return vocab, weights/weights.sum()
+
+# write a corpus shaped like downloadData.py's PubMed_results.parquet with numAbstracts rows
+# 5% have no abstract and 3% no year (like papers the counter filters out), abstracts are 50-300 words
+def writeSyntheticCorpus(path, numAbstracts, seed = 0, chunkSize = 10000):
+    import numpy as np
+    from corpusStore import CorpusWriter
+    rng = np.random.default_rng(seed)
+    vocab, probabilities = syntheticCorpusVocab(rng)
+
+    with CorpusWriter(path) as writer:
+        for start in range(0, numAbstracts, chunkSize):
+            count = min(chunkSize, numAbstracts-start)
+            lengths = rng.integers(50, 301, count)
+            words = vocab[rng.choice(len(vocab), lengths.sum(), p=probabilities)]
+            ends = np.cumsum(lengths)
+            abstracts = [" ".join(words[end-length:end]) + "." for end, length in zip(ends.tolist(), lengths.tolist())]
+            years = rng.integers(1950, 2026, count).tolist()
+            months = rng.choice(monthNames, count).tolist()
+            hasAbstract = (rng.random(count) >= 0.05).tolist()
+            hasYear = (rng.random(count) >= 0.03).tolist()
+
+            pmids = [str(10000000+start+i) for i in range(count)]
+            writer.writeColumns({
+                "PMID": pmids,
+                "Title": [abstract[:80] for abstract in abstracts],
+                "Abstract": [abstract if keep else None for abstract, keep in zip(abstracts, hasAbstract)],
+                "Authors": ["Last Fore, Other Name"]*count,
+                "Journal": [f"Journal {year % 20}" for year in years],
+                "Keywords": ["Urology, Humans"]*count,
+                "URL": [f"https://www.ncbi.nlm.nih.gov/pubmed/{pmid}" for pmid in pmids],
+                "Affiliations": ["Department of Urology, University"]*count,
+                "pubDate": [json.dumps({"Year": str(year), "Month": month} if keep else {"MedlineDate": f"{year} Spring"})
+                            for year, month, keep in zip(years, months, hasYear)],
+            })
+
+benchmarkStages = ("load", "getWords", "tokenize", "phrase_matcher", "aggregation", "pipeline1_formatting", "pipeline1_csv")
+benchmarkTerms = "Depression,anxiety,prostate,cancer,Borderline personality disorder,x-ray"
+
+# run one databaseWordCounter.py stage over the corpus at corpusPath and return its StageTimer stats
+# what the stage needs is built first without being timed (run in a fresh process, so other stages don't run before it)
+# its peak memory only covers the timed body on linux (see StageTimer.stage), the memory the setup still holds is in it,
+# peak_rss_growth_mb is what the stage itself added
+def runStage(stage, corpusPath):
+    import corpusStore
+    from databaseWordCounter import getWords, buildTokenCorpus
+    from tokenizer import Tokenizer
+    from phraseMatcher import PhraseMatcher, parseTerms
+    from yearWordMatrix import YearWordMatrix
+    from wordsToFilterList import wordsToFilterList
+    from stageTimer import StageTimer
+
+    timer = StageTimer()
+    filterNums = True
+    wordsWeDontWant = set(Tokenizer(filterNums).tokenize(wordsToFilterList))
+
+    def load():
+        pubDates, abstracts = [], []
+        for batch in corpusStore.iterBatches(corpusPath, columns=["pubDate","Abstract"]):
+            pubDates += batch["pubDate"]
+            abstracts += batch["Abstract"]
+        return pubDates, abstracts
+
+    def parse(tokenizer, pubDates, abstracts):
+        return buildTokenCorpus(zip(pubDates, abstracts), tokenizer)
+
+    if stage == "load":
+        with timer.stage(stage, "papers") as record:
+            pubDates, abstracts = load()
+            record["papers"] = len(pubDates)
+
+    elif stage in ("getWords", "tokenize", "phrase_matcher"):
+        pubDates, abstracts = load()
+        pubDates, abstracts = zip(*[(pubDate, abstract) for pubDate, abstract in zip(pubDates, abstracts) if abstract is not None])
+        with timer.stage(stage, "abstracts") as record:
+            if stage == "getWords":
+                #the reference tokenizer
+                for abstract in abstracts:
+                    getWords(abstract, filterNums, wordsWeDontWant)
+            elif stage == "tokenize":
+                parse(Tokenizer(filterNums, wordsWeDontWant), pubDates, abstracts)
+            else:
+                parse(PhraseMatcher(parseTerms(benchmarkTerms, filterNums, wordsWeDontWant), filterNums, wordsWeDontWant), pubDates, abstracts)
+            record["abstracts"] = len(abstracts)
+
+    elif stage == "aggregation":
+        corpus = parse(Tokenizer(filterNums, wordsWeDontWant), *load())
+        with timer.stage(stage, "tokens") as record:
+            YearWordMatrix.fromTokenCorpus(corpus)
+            record["tokens"] = len(corpus.tokens)
+
+    elif stage in ("pipeline1_formatting", "pipeline1_csv"):
+        matrix = YearWordMatrix.fromTokenCorpus(parse(Tokenizer(filterNums, wordsWeDontWant), *load()))
+        with tempfile.TemporaryDirectory() as tmpDir, timer.stage(stage, "entries") as record:
+            if stage == "pipeline1_formatting":
+                #format every value without writing the csv
+                for yearInd in range(len(matrix.years)):
+                    order = matrix.yearOrder(yearInd)
+                    for blockStart in range(0, len(order), 2000):
+                        matrix.formatEntries(yearInd, order[blockStart:blockStart+2000])
+            else:
+                matrix.writeWordcountCsv(os.path.join(tmpDir, "wordcount.csv"))
+            record["entries"] = len(matrix.wordIds)
+
+    else:
+        raise Exception(f"Unknown stage '{stage}', expected one of {benchmarkStages}")
+
+    return timer.stages[stage]
+
+# generate a corpus of each size and run each stage on it in its own process
+def benchmarkStagesOnCorpora(sizes, stages, corpusDir):
+    results = dict()
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        corpusPath = os.path.join(corpusDir, f"benchmarkCorpus_{size}.parquet")
+        if not os.path.exists(corpusPath):
+            print(f"Generating {size} abstracts")
+            writeSyntheticCorpus(corpusPath, size)
+
+        results[size] = dict()
+        for stage in stages:
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                results[size][stage] = pool.submit(runStage, stage, corpusPath).result()
+            print(size, stage, results[size][stage])
+    return results
+
+def loadXmlResponses(args):
+    if args.xml:
+        responses = []
+        for path in args.xml:
+            with open(path, "rb") as f:
+                responses.append(f.read())
+        return responses
+
+    chunkSize = 500
+    return [syntheticEfetchXml(min(chunkSize, args.synthetic-start), 1000000+start) for start in range(0, args.synthetic, chunkSize)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the slow stages of the pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    extraction = subparsers.add_parser("extraction", help="records/second of turning efetch xml into corpus rows")
+    extraction.add_argument("--xml", nargs="*", help="saved efetch responses (downloadData.py --saveXmlDir)")
+    extraction.add_argument("--synthetic", type=int, default=5000, help="number of generated articles if no --xml is given")
+
+    parsing = subparsers.add_parser("parsing", help="streaming efetch parser against Entrez.read (speed, memory, matching rows)")
+    parsing.add_argument("--xml", nargs="*", help="saved efetch responses (downloadData.py --saveXmlDir)")
+    parsing.add_argument("--synthetic", type=int, default=5000, help="number of generated articles if no --xml is given")
+
+    stages = subparsers.add_parser("stages", help="wall time, peak memory and throughput of each word counting stage on generated corpora")
+    stages.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="numbers of abstracts to generate")
+    stages.add_argument("--stages", nargs="+", choices=benchmarkStages, default=list(benchmarkStages))
+    stages.add_argument("--corpusDir", help="keep the generated corpora here and reuse them (default: a temporary folder)")
+    stages.add_argument("--output", default="benchmarkResults.json", help="machine readable results file")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "extraction":
+        result = benchmarkExtraction(loadXmlResponses(args))
+        print(f"{result['records']} records in {result['seconds']:.2f}s: {result['records_per_second']:.0f} records/second")
+
+    elif args.benchmark == "parsing":
+        results = benchmarkParsing(loadXmlResponses(args))
+        for name in ("entrez_read", "efetch_parser"):
+            result = results[name]
+            print(f"{name}: {result['records_per_second']:.0f} records/second, peak {result['peak_mb_per_response']:.1f} MB per response")
+        print("mismatched values:", results["mismatched_values"])
+
+    elif args.benchmark == "stages":
+        if args.corpusDir:
+            os.makedirs(args.corpusDir, exist_ok=True)
+            results = benchmarkStagesOnCorpora(args.sizes, args.stages, args.corpusDir)
+        else:
+            with tempfile.TemporaryDirectory() as corpusDir:
+                results = benchmarkStagesOnCorpora(args.sizes, args.stages, corpusDir)
+
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version, "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, f, indent=4)
+        print("Saved", args.output)
+
+if __name__ == "__main__":
+    main()
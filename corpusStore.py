@@ -0,0 +1,129 @@
+# columnar on-disk store for the downloaded pubmed records
+# downloadData.py writes it, databaseWordCounter.py streams only the columns it needs from it
+import os
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+corpusColumns = ['PMID', 'Title', 'Abstract', 'Authors', 'Journal', 'Keywords', 'URL', 'Affiliations','pubDate','fullRecord']
+corpusSchema = pa.schema([(column, pa.string()) for column in corpusColumns])
+
+defaultCorpusFile = "PubMed_results.parquet"
+defaultExcelFile = "PubMed_results.xlsx"
+
+rowGroupSize = 10000 # rows per compressed chunk, also the default read batch size
+compression = "zstd"
+
+# convert a cell to what the store holds (string or missing)
+def toCell(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value != value:
+        return None #NaN from pandas
+    return str(value)
+
+# writes rows to the store in row groups, file only appears under its real name once closed
+# metadata: dict of strings saved in the file (see readMetadata)
+class CorpusWriter:
+    def __init__(self, path, rowGroupSize = rowGroupSize, metadata = None):
+        self.path = path
+        self.tmpPath = path + ".tmp"
+        self.rowGroupSize = rowGroupSize
+        self.numRows = 0
+        self.buffer = {column: [] for column in corpusColumns}
+        schema = corpusSchema.with_metadata(metadata) if metadata else corpusSchema
+        self.writer = pq.ParquetWriter(self.tmpPath, schema, compression=compression)
+
+    # row is a dict of column name to value (missing columns are left empty)
+    def writeRow(self, row):
+        for column in corpusColumns:
+            self.buffer[column].append(toCell(row.get(column)))
+        if len(self.buffer['PMID']) >= self.rowGroupSize:
+            self.flush()
+
+    def writeRows(self, rows):
+        for row in rows:
+            self.writeRow(row)
+
+    # columns is a dict of column name to list of values (like the batches from iterBatches)
+    def writeColumns(self, columns):
+        numNew = len(next(iter(columns.values())))
+        for column in corpusColumns:
+            values = columns.get(column)
+            self.buffer[column].extend([toCell(value) for value in values] if values is not None else [None]*numNew)
+        if len(self.buffer['PMID']) >= self.rowGroupSize:
+            self.flush()
+
+    def writeDataFrame(self, df):
+        self.writeRows(df.to_dict("records"))
+
+    def flush(self):
+        numBuffered = len(self.buffer['PMID'])
+        if numBuffered == 0:
+            return
+        self.writer.write_table(pa.table(self.buffer, schema=corpusSchema), row_group_size=self.rowGroupSize)
+        self.numRows += numBuffered
+        self.buffer = {column: [] for column in corpusColumns}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmpPath, self.path)
+
+    # drop the partial file without replacing the old store
+    def abort(self):
+        self.writer.close()
+        os.remove(self.tmpPath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+def numRows(path):
+    return pq.ParquetFile(path).metadata.num_rows
+
+# the metadata dict a CorpusWriter saved in the file (empty if none)
+def readMetadata(path):
+    metadata = pq.read_schema(path).metadata or dict()
+    return {key.decode(): value.decode() for key, value in metadata.items()}
+
+# yield batches as dicts of column name to list of values, only reading the columns asked for
+def iterBatches(path, columns = None, batchSize = rowGroupSize):
+    parquetFile = pq.ParquetFile(path)
+    for batch in parquetFile.iter_batches(batch_size=batchSize, columns=columns):
+        yield batch.to_pydict()
+
+# optional excel export made from the store
+def exportToExcel(path, excelPath):
+    pq.read_table(path).to_pandas().to_excel(excelPath, index=False)
+
+# convert an excel sheet made by older versions of downloadData.py into the store
+def importFromExcel(excelPath, path):
+    import pandas as pd
+    df = pd.read_excel(excelPath, dtype=str).dropna(how="all")
+    with CorpusWriter(path) as writer:
+        writer.writeDataFrame(df)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between the columnar corpus store and excel")
+    parser.add_argument("--toExcel", action="store_true", help=f"export the store to {defaultExcelFile}")
+    parser.add_argument("--fromExcel", action="store_true", help=f"build the store from an old {defaultExcelFile}")
+    parser.add_argument("--corpus", default=defaultCorpusFile)
+    parser.add_argument("--excel", default=defaultExcelFile)
+    args = parser.parse_args()
+
+    if args.toExcel == args.fromExcel:
+        parser.error("pass exactly one of --toExcel or --fromExcel")
+
+    if args.toExcel:
+        exportToExcel(args.corpus, args.excel)
+    else:
+        importFromExcel(args.excel, args.corpus)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,25 @@
 import re
-import csv
 import os
-import pandas as pd
-import numpy as np
 import time
 from tqdm import tqdm
 import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from wordsToFilterList import wordsToFilterList
+import corpusStore
+import wordAggregation
+from tokenizer import Tokenizer
+from phraseMatcher import PhraseMatcher
+from wordIndex import WordIndex, defaultIndexFile
+from yearWordMatrix import YearWordMatrix
+from tokenCorpus import TokenCorpus, TokenCorpusBuilder
+from stageTimer import StageTimer
+from batchAnalysis import BatchConfig, readConfigs, BatchTokenizer, countConfigs
+from yearWordOutput import YearWordWriter, writeYearWordCounts, yearWordFormats
 
 #get list of words
+#reference implementation, main uses tokenizer.Tokenizer which must give identical words (run tokenizer.py to check)
 def getWords(text, filterNums, wordsWeDontWant = ()):
     #remove everything but words, digits, whitespace, apostrophe, and dash (replace with space)
     text = re.sub(r'[^\w\d\s\'-]+', ' ', text)
@@ -43,120 +54,214 @@ def getWords(text, filterNums, wordsWeDontWant = ()):
 
     return newText
 
-# output all words with their year beside them
-def outputYearWord(toProcess,wordsWeWant,outputDir):
-    output = [["year","word"]]
+# year and abstract text of one paper, None if it has no year or no abstract
+def getYearAndAbstract(pubDate, abstract):
+    #get year
+    if(not pubDate):
+        return None #filter no year
     
-    #count statistics
-    for study in tqdm(toProcess,desc="Calculating statistics", leave=True) :
-        currentWordlist = study["words"]
-        for word in currentWordlist:
-            #filter only words we want
-            if wordsWeWant is not None and (word not in wordsWeWant):
-                continue
-
-            output.append([study["year"],word])
-
-    print("Saving raw_word_year.csv")
-    #save the excel sheet with name of status
-    with open(os.path.join(outputDir,'raw_word_year.csv'), 'w', newline='', encoding="utf-8-sig") as fp:
-            writer = csv.writer(fp, quoting=csv.QUOTE_NONNUMERIC)
-            writer.writerows(output)
-
-#populate study dict for pipeline 1
-def getStudyDictForPipeline1(toProcess,wordsWeWant):
-    class YearEntry:
-        def __init__(self):
-            self.wordDict = dict()
-            self.numStudies = 0
-
-    class WordEntry:
-        def __init__(self):
-            self.totalNumMentions = 0
-            self.listOfPercentOfStudy = []
-            self.numStudiesMentioning = 0
-
-    studyDict = dict()
-
-    #count statistics
-    for study in tqdm(toProcess,desc="Calculating statistics", leave=True) :
-        year = study["year"]
-
-        if year not in studyDict:
-            studyDict[year] = YearEntry()
-
-        yearArr = studyDict[year]
-        yearDict = yearArr.wordDict
-        yearArr.numStudies = yearArr.numStudies+1
-        wordsFoundInCurrentStudy = set()
-        currentWordlist = study["words"]
-        for word in currentWordlist:
-            #filter only words we want
-            if wordsWeWant is not None and (word not in wordsWeWant):
-                continue
-
-            #word already found in year
-            if word in yearDict:
-                yearDict[word].totalNumMentions = yearDict[word].totalNumMentions+ 1
-            else:
-                yearDict[word] = WordEntry()
-                yearDict[word].totalNumMentions = 1
-                
-            
-            #word not already found in block
-            if(word not in wordsFoundInCurrentStudy):
-                #percent of word in respective text
-                wordsFoundInCurrentStudy.add(word)
-                percentOfWord = 100.0*currentWordlist.count(word)/len(currentWordlist)
-                yearDict[word].listOfPercentOfStudy.append(percentOfWord)
-                #count num studies in year mentioning word
-                yearDict[word].numStudiesMentioning = yearDict[word].numStudiesMentioning+1
+    year = json.loads(pubDate)
+    if("Year" not in year):
+        return None #filter no year
+
+    year=int(year["Year"])
+    if(year<1950 or year>2025):
+        raise Exception(f"Unexpected year val {year}")
+
+    # get abstract
+    if(abstract is None):
+        return None #filter no abstract
+    abstract = str(abstract)
+    if(abstract.strip() == "" or abstract.strip() == "nan"):
+        return None #filter no abstract
+    return year, abstract
+
+# get year and words of one paper, None if it has no year or no abstract
+def parseStudy(pubDate, abstract, tokenizer):
+    yearAndAbstract = getYearAndAbstract(pubDate, abstract)
+    if(yearAndAbstract is None):
+        return None
+    year, abstract = yearAndAbstract
+    words, numWords = tokenizer.tokenizeWithCount(abstract)
     
-    return studyDict
+    #prepare input
+    return {"year":year,
+            "words":words,
+            "numWords":numWords #number of words in the abstract (words only holds the wanted ones with a PhraseMatcher)
+            }
+
+# word ids of the papers with a year and abstract as a TokenCorpus (one vocabulary and flat id arrays instead of a word list per paper)
+# rows: (pubDate, abstract) pairs, tokenizer: Tokenizer or PhraseMatcher
+def buildTokenCorpus(rows, tokenizer):
+    builder = TokenCorpusBuilder()
+    for pubDate, abstract in rows:
+        yearAndAbstract = getYearAndAbstract(pubDate, abstract)
+        if(yearAndAbstract is None):
+            continue
+        year, abstract = yearAndAbstract
+        ids, numWords = tokenizer.tokenizeIds(abstract, builder.vocab)
+        builder.addStudy(year, ids, numWords)
+    return builder.finish()
+
+# parse the corpus (load and tokenize) into a TokenCorpus
+def parseCorpus(inputFile, numPapers, tokenizer):
+    def rows(progress):
+        for batch in corpusStore.iterBatches(inputFile, columns=["pubDate","Abstract"]):
+            yield from zip(batch["pubDate"], batch["Abstract"])
+            progress.update(len(batch["pubDate"]))
+
+    with tqdm(total=numPapers, desc="Parsing Data", leave=True) as progress:
+        return buildTokenCorpus(rows(progress), tokenizer)
+
+# parsed corpus from the token cache folder if it was built from the same corpus file with the same tokenizer, else parse and save it there
+# the cached arrays are memory mapped, so they are paged in as they are read instead of all held in memory
+def loadTokenCorpus(inputFile, numPapers, tokenizer, cacheDir):
+    corpusFileStat = os.stat(inputFile)
+    meta = {"configHash": tokenizer.configHash(), "corpusFile": inputFile,
+            "corpusSize": corpusFileStat.st_size, "corpusMtimeNs": corpusFileStat.st_mtime_ns}
+    if(TokenCorpus.readMeta(cacheDir) == meta):
+        print("Using parsed corpus from", cacheDir)
+        return TokenCorpus.load(cacheDir), True
+
+    TokenCorpus.checkSaveDirectory(cacheDir)
+    corpus = parseCorpus(inputFile, numPapers, tokenizer)
+    corpus.save(cacheDir, meta)
+    return TokenCorpus.load(cacheDir), False
+
+# output all words with their year beside them (rows are written a block of studies at a time, see yearWordOutput)
+def outputYearWord(corpus,wordsWeWant,outputDir):
+    with YearWordWriter(outputDir, wordsWeWant) as writer:
+        writer.writeTokenCorpus(corpus)
+
+#count statistics of the parsed corpus for pipeline 1, as a year x word matrix (counted on word ids)
+def getMatrixForPipeline1(corpus,wordsWeWant):
+    return YearWordMatrix.fromTokenCorpus(corpus, wordsWeWant)
+
+# state of each worker process in multi-core mode (set once by initCountWorker instead of sent with every shard)
+workerState = dict()
+
+def initCountWorker(tokenizer, wordsWeWant, keepStudies):
+    workerState["tokenizer"] = tokenizer
+    workerState["wordsWeWant"] = wordsWeWant
+    workerState["keepStudies"] = keepStudies
+
+# parse and count one shard of rows in a worker, returns (partial year/word tallies, num studies kept, studies if kept else None)
+def countShard(pubDates, abstracts):
+    partialDict = dict()
+    studies = []
+    for pubDate, abstract in zip(pubDates, abstracts):
+        study = parseStudy(pubDate, abstract, workerState["tokenizer"])
+        if study is None:
+            continue
+        wordAggregation.addStudyToPartial(partialDict, study["year"], study["words"], workerState["wordsWeWant"], study["numWords"])
+        studies.append(study)
 
-# pipeline for output
-def pipeline1(toProcess,wordsWeWant,outputDir):
+    return partialDict, len(studies), (studies if workerState["keepStudies"] else None)
 
-    studyDict = getStudyDictForPipeline1(toProcess,wordsWeWant)
-    
-    #format data
-    colTitles = ["word","number of mentions","Avg percent of mentions per study","percent of studies in year mentioning word"]
-    colsPerYear = len(colTitles)
-    #count max words
-    maxWords = 0
-    for yearVal in studyDict.values():
-        maxWords = max(maxWords,len(yearVal.wordDict))
-    
-    shape = (maxWords+2,colsPerYear*len(studyDict))
-    output =np.full(shape, "", dtype="object", order='C')
-
-    sortedYears = sorted(studyDict.items(), key=lambda item: int(item[0]))
-    for yearInd,(yearKey,yearValArr) in tqdm(enumerate(sortedYears), total = len(studyDict), desc="Formating data", leave=True):
-        yearVal = yearValArr.wordDict
-        #titles
-        col = yearInd*colsPerYear
-        output[0,col] = yearKey
-        output[0,col+1] = "Num studies:"+str(yearValArr.numStudies)
-        output[1,col:col+colsPerYear]=colTitles
-
-        #values
-        sortedWords = sorted(yearVal.items(), key=lambda item: item[1].totalNumMentions,reverse =True)
-        for row,(wordKey,wordVal) in enumerate(sortedWords):
-            #for average, divide by number of studies in group (not len(wordVal.listOfPercentOfStudy) since wordVal.listOfPercentOfStudy has no entries of 0%)
-            # ["word","number of mentions","Avg percent of mentions per study","percent of studies in year mentioning word"]
-            avgPercentMentionsPerStudy = str(sum(wordVal.listOfPercentOfStudy)/yearValArr.numStudies)+"%"
-            percentStudiesMentioningWord = str(100*wordVal.numStudiesMentioning/yearValArr.numStudies)+"%"
-            output[row+2,col:col+colsPerYear]=[wordKey,wordVal.totalNumMentions,avgPercentMentionsPerStudy,percentStudiesMentioningWord]
-
-    #save the excel sheet with name of status
-    with open(os.path.join(outputDir,'wordcount.csv'), 'w', newline='', encoding="utf-8-sig") as fp:
-            writer = csv.writer(fp, quoting=csv.QUOTE_NONNUMERIC)
-            writer.writerows(output.tolist())
+# parse and count the corpus with a pool of worker processes, each shard's tallies are merged in input order
+# gives the same counts as getMatrixForPipeline1 over the serially parsed corpus
+# if yearWordWriter is given, each shard's studies are written to it in input order
+# tokenizer is a Tokenizer or PhraseMatcher, sent to each worker once
+def getStudyDictParallel(inputFile, numPapers, workers, tokenizer, wordsWeWant, yearWordWriter = None, shardSize = 2000):
+    studyDict = dict()
+    numStudies = 0
+    keepStudies = yearWordWriter is not None
+
+    with ProcessPoolExecutor(workers, initializer=initCountWorker, initargs=(tokenizer, wordsWeWant, keepStudies)) as pool, \
+         tqdm(total=numPapers, desc="Parsing and counting data", leave=True) as progress:
+        pending = deque() #(future, num rows), kept in input order
+        
+        def mergeNext():
+            nonlocal numStudies
+            future, numRows = pending.popleft()
+            partialDict, numShardStudies, studies = future.result()
+            wordAggregation.mergePartial(studyDict, partialDict)
+            numStudies += numShardStudies
+            if studies is not None:
+                yearWordWriter.writeStudies(studies)
+            progress.update(numRows)
+
+        for batch in corpusStore.iterBatches(inputFile, columns=["pubDate","Abstract"], batchSize=shardSize):
+            pending.append((pool.submit(countShard, batch["pubDate"], batch["Abstract"]), len(batch["pubDate"])))
+            # limit shards in flight so the corpus is never all in memory
+            if len(pending) >= 2*workers:
+                mergeNext()
+        while pending:
+            mergeNext()
+
+    return studyDict, numStudies
+
+# batch mode: count each configuration (see batchAnalysis) from one parse of the corpus, into its own folder of outputDir
+# yearWordFormat: "counts" or "parquet" to also write each configuration's year word counts (see yearWordOutput), None for none
+def runBatch(configs, inputFile, numPapers, outputDir, tokenCache, overwrite, timer, startTime, yearWordFormat = None):
+    tokenizer = BatchTokenizer(configs)
+
+    #parse corpus once for all configurations
+    with timer.stage("parse", "papers") as record:
+        tokenCacheUsed = None
+        if(tokenCache is not None):
+            corpus, tokenCacheUsed = loadTokenCorpus(inputFile, numPapers, tokenizer, os.path.abspath(tokenCache))
+        else:
+            corpus = parseCorpus(inputFile, numPapers, tokenizer)
+        record["papers"] = numPapers
+
+    with timer.stage("batch_counting", "tokens") as record:
+        matrices = countConfigs(corpus, configs)
+        record["tokens"] = len(corpus.tokens)
+
+    for config, matrix in tqdm(list(zip(configs, matrices)), desc="Saving configurations", leave=True):
+        configDir = os.path.join(outputDir, config.name)
+        os.makedirs(configDir, exist_ok = overwrite)
+        configTimer = StageTimer()
+        if(yearWordFormat is not None):
+            with configTimer.stage("year_word_output"):
+                writeYearWordCounts(matrix, configDir, yearWordFormat)
+        pipeline1(matrix, configDir, configTimer)
+
+        stats = dict()
+        stats["batch_configuration"] = {"name": config.name, **config.ownSettings}
+        stats["words_filtered_out"] = str(config.wordsWeDontWant)
+        stats["filter_out_numbers"] = str(config.filterNums)
+        stats["words_that_were_specifically_tested"] = str(config.wordsWeWant)
+        stats["Num_papers_assuming_duplicates_already_filtered"] = numPapers
+        stats["num_papers_after_filter_no_year_or_no_abstract"] = len(corpus)
+        if(tokenCacheUsed is not None):
+            stats["token_cache_used"] = tokenCacheUsed
+        stats["stage_timings"] = {**timer.stages, **configTimer.stages} #parsing and counting are shared by the batch
+        stats["total_seconds"] = round(time.time()-startTime, 4)
+        with open(os.path.join(configDir,"otherData.txt"), 'w') as f:
+            f.writelines([json.dumps(stats, indent=4),])
+
+# pipeline for output, matrix is the sparse year x word matrix of the counts (see yearWordMatrix)
+def pipeline1(matrix,outputDir,timer = None):
+    if timer is None:
+        timer = StageTimer()
+
+    #save the csv a block of rows at a time
+    with timer.stage("pipeline1_csv", "entries") as record:
+        matrix.writeWordcountCsv(os.path.join(outputDir,'wordcount.csv'))
+        record["entries"] = len(matrix.wordIds)
 
 def main():
     stats = dict() #used for other notes
 
+    parser = argparse.ArgumentParser(description="Count words in the downloaded pubmed abstracts")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to parse and count with (1 = serial)")
+    parser.add_argument("--useIndex", action="store_true", help=f"keep counts in a persistent index ({defaultIndexFile}) and only count papers added since the last run")
+    parser.add_argument("--indexFile", default=defaultIndexFile)
+    parser.add_argument("--overwrite", action="store_true", help="write into an existing Output folder")
+    parser.add_argument("--batch", metavar="FILE", help="json file of named configurations to count from one parse of the corpus, each into Output/<name> (see README)")
+    parser.add_argument("--tokenCache", metavar="DIR", help="save the parsed corpus (word ids) to DIR and memory map it from there in later runs, until the corpus or word filters change")
+    args = parser.parse_args()
+    if(args.useIndex and args.workers > 1):
+        parser.error("--useIndex updates the index in a single process, it can't be combined with --workers")
+    if(args.tokenCache is not None and (args.useIndex or args.workers > 1)):
+        parser.error("--tokenCache is used by the single process run, it can't be combined with --useIndex or --workers")
+    if(args.batch is not None and (args.useIndex or args.workers > 1)):
+        parser.error("--batch counts every configuration in one process, it can't be combined with --useIndex or --workers")
+
     startTime = time.time()
+    timer = StageTimer() #wall time, peak memory and throughput of each stage, saved in otherData.txt
     print("Starting")
 
     # word filters
@@ -164,14 +269,27 @@ def main():
     wordsWeDontWant = wordsToFilterList
     filterNums = True #if true, filter out words that are entirely numbers
     yearWordMode = False # if true, outputs each word accompanied by year it showed up in
-
-    wordsWeDontWant = set(getWords(wordsWeDontWant,filterNums))
-    
-    if(wordsWeWant is not None):
-        wordsWeWant = set(getWords(wordsWeWant,filterNums))
-        for word in wordsWeWant:
-            if(word in wordsWeDontWant):
-                raise Exception(f"Cant have word in both wordsWeWant and wordsWeDontWant: '{word}'")
+    yearWordFormat = "rows" # "rows": raw_word_year.csv with a row per word, "counts": raw_word_year_counts.csv with (year, word, count) rows, "parquet": the same counts as a compressed columnar file
+
+    if(yearWordFormat not in yearWordFormats):
+        raise Exception(f"yearWordFormat must be one of {yearWordFormats}, not '{yearWordFormat}'")
+
+    #settings above are the defaults of the batch configurations, without --batch the run is the one configuration of them
+    #(wordsWeWant is split into terms, each comma separated part is a term, a part with several words is counted as a phrase)
+    defaultSettings = {"wordsWeWant": wordsWeWant, "filterNums": filterNums, "wordsToFilterList": wordsWeDontWant}
+    batchConfigs = None
+    if(args.batch is not None):
+        if(yearWordMode and yearWordFormat == "rows"):
+            raise Exception('--batch can\'t write raw_word_year.csv, set yearWordFormat to "counts" or "parquet" to get the year word counts of each configuration')
+        batchConfigs = readConfigs(args.batch, defaultSettings)
+
+    runConfig = BatchConfig(None, dict(), defaultSettings)
+    wordsWeDontWant = runConfig.wordsWeDontWant
+    wantedTerms = runConfig.terms
+    wordsWeWant = runConfig.wordsWeWant
+    if(wantedTerms is not None):
+        if(args.useIndex and any(len(term) > 1 for term in wantedTerms)):
+            parser.error("the index only holds single words, phrases in wordsWeWant can't be counted with --useIndex")
         print("Edited wordswewant list to look like the following:",wordsWeWant)
     
     stats["words_filtered_out"] = str(wordsWeDontWant)
@@ -185,47 +303,74 @@ def main():
 
     #check for old output and create output folder
     outputDir = os.path.abspath("./Output")
-    os.makedirs(outputDir, exist_ok = False)
-
-    #load original excel file
-    toProcess = []
-    inputFile = os.path.abspath("./PubMed_results.xlsx")
-    inputDF = pd.read_excel(inputFile).dropna(how="all")
-    stats["Num_papers_assuming_duplicates_already_filtered"] = len(inputDF)
-    
-    #parse original excel file
-    for index, row in tqdm(inputDF.iterrows(), total=len(inputDF), desc="Parsing Data", leave=True) :
-        #get year
-        yearKeyToLookFor = "pubDate"
-        year = row[yearKeyToLookFor]
-        if(type(year) != str):
-            continue #filter no year
-        
-        year = json.loads(year)
-        if("Year" not in year):
-            continue #filter no year
-
-        year=int(year["Year"])
-        if(year<1950 or year>2025):
-            raise Exception(f"Unexpected year val {year}")
-
-        # get abstract
-        abstract = str(row["Abstract"])
-        if(abstract.strip() == "" or abstract.strip() == "nan"):
-            continue #filter no abstract
-        abstract = getWords(abstract,filterNums,wordsWeDontWant)
-        
-        #prepare input
-        toProcess.append({"year":year,
-                       "words":abstract
-                       })
+    os.makedirs(outputDir, exist_ok = args.overwrite)
+
+    tokenizer = Tokenizer(filterNums, wordsWeDontWant)
+    #targeted runs only look for the wanted terms instead of tokenizing every abstract (the index needs every word)
+    if(wantedTerms is not None and not args.useIndex):
+        tokenizer = PhraseMatcher(wantedTerms, filterNums, wordsWeDontWant)
+
+    #stream the columns we need from the corpus store
+    inputFile = os.path.abspath(corpusStore.defaultCorpusFile)
+    numPapers = corpusStore.numRows(inputFile)
+    stats["Num_papers_assuming_duplicates_already_filtered"] = numPapers
+
+    if(batchConfigs is not None):
+        runBatch(batchConfigs, inputFile, numPapers, outputDir, args.tokenCache, args.overwrite, timer, startTime, yearWordFormat if yearWordMode else None)
+        print("Done:",time.time()-startTime)
+        return
+
+    index = None
+    corpus = None #parsed corpus as word ids, for raw_word_year.csv (not kept with --workers)
+    if(args.useIndex):
+        with timer.stage("index_update", "papers") as record:
+            index = WordIndex(os.path.abspath(args.indexFile), tokenizer.configHash())
+            indexStats = index.update(inputFile, lambda pubDate, abstract: parseStudy(pubDate, abstract, tokenizer))
+            stats["num_papers_after_filter_no_year_or_no_abstract"] = index.numStudies()
+            stats.update(indexStats)
+            matrix = YearWordMatrix.fromStudyDict(index.getStudyDict(wordsWeWant))
+            if(yearWordMode and yearWordFormat == "rows"):
+                corpus = index.tokenCorpus()
+            record["papers"] = numPapers
+    elif(args.workers > 1):
+        with timer.stage("parse_and_count", "papers") as record:
+            #raw_word_year.csv is written while the shards are merged
+            streamYearWord = yearWordMode and yearWordFormat == "rows"
+            yearWordWriter = YearWordWriter(outputDir, wordsWeWant) if streamYearWord else None
+            studyDict, numStudies = getStudyDictParallel(inputFile, numPapers, args.workers, tokenizer, wordsWeWant, yearWordWriter)
+            if(yearWordWriter is not None):
+                yearWordWriter.close()
+            matrix = YearWordMatrix.fromStudyDict(studyDict)
+            stats["num_papers_after_filter_no_year_or_no_abstract"] = numStudies
+            record["papers"] = numPapers
+    else:
+        #parse corpus (load and tokenize)
+        with timer.stage("parse", "papers") as record:
+            if(args.tokenCache is not None):
+                corpus, stats["token_cache_used"] = loadTokenCorpus(inputFile, numPapers, tokenizer, os.path.abspath(args.tokenCache))
+            else:
+                corpus = parseCorpus(inputFile, numPapers, tokenizer)
+            record["papers"] = numPapers
 
-    stats["num_papers_after_filter_no_year_or_no_abstract"] = len(toProcess)
+        stats["num_papers_after_filter_no_year_or_no_abstract"] = len(corpus)
+        with timer.stage("aggregation", "tokens") as record:
+            matrix = getMatrixForPipeline1(corpus,wordsWeWant)
+            record["tokens"] = len(corpus.tokens)
 
     if(yearWordMode):
-        outputYearWord(toProcess,wordsWeWant,outputDir)
+        with timer.stage("year_word_output"):
+            if(yearWordFormat != "rows"):
+                writeYearWordCounts(matrix, outputDir, yearWordFormat)
+            elif(corpus is not None):
+                outputYearWord(corpus,wordsWeWant,outputDir)
     
-    pipeline1(toProcess,wordsWeWant,outputDir)
+    pipeline1(matrix,outputDir,timer)
+
+    if(index is not None):
+        index.close()
+
+    stats["stage_timings"] = timer.stages
+    stats["total_seconds"] = round(time.time()-startTime, 4)
 
     # write other stats
     with open(os.path.join(outputDir,"otherData.txt"), 'w') as f:
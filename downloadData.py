@@ -1,161 +1,326 @@
 # Marc Morcos
 # loosely based on https://github.com/TLDWTutorials/PubmedAPI/blob/main/pubmed_api_in_python_2024.py
-import pandas as pd
+import io
+import os
 import json
+import shutil
+import hashlib
+import argparse
+from datetime import date
 from Bio import Entrez
-from apiKey import apiKey,email
 from tqdm import tqdm
-import time
-
-# what to do on Entrez exception, e is exception
-def errorHandle(e):
-    # auto retry on common errors
-    if("Status: 500" in str(e) or "400" in str(e)):
-        print(e)
-        print("Retrying")
-        time.sleep(Entrez.sleep_between_tries)
-        return
-
-    # else wait for user on error
-    print(e)
-    print("Press enter to retry")
-    input()
-
-# API key, allows 10 requests per second (without, its 3)
-Entrez.email = email
-Entrez.api_key = apiKey
-
+from corpusStore import CorpusWriter, defaultCorpusFile, defaultExcelFile, exportToExcel, iterBatches, numRows, readMetadata
+from entrezScheduler import EntrezScheduler, defaultBaseUrl
+from efetchParser import iterRecords
+from searchPlanner import SearchRange, planRanges, searchRange, pageStarts
 
-# retry in case of error
-Entrez.max_tries = 15
-Entrez.sleep_between_tries = 15
+# also export the results to an excel sheet (slow on large pulls, the columnar store is what databaseWordCounter.py reads)
+exportExcel = False
 
 full_query = '("Urology"[MeSH Terms] OR "Urology"[All Fields])'
 
-# Get IDs to process (matching query)
-# Get IDs per Month to avoid hitting 9999 limit
-id_list = []
 startYear = 1950
 endYear = 2025
-maxStudies = 9999 # imposed by API
-
-# loop through all months in year range individually
-for year in tqdm(range(startYear,endYear+1),desc="Getting pmids",leave=True):
-    for month in range(1,13):
-
-        while True: #pause, wait for user, and retry on error
-            try:
-                monthQuery = full_query + f' AND ("{year}/{month}:{year}/{month}[pdat])'
-
-                # make sure its not too many studies
-                handle = Entrez.esearch(db='pubmed',
-                                rettype='count',
-                                term=monthQuery)
-                totalStudies = int(Entrez.read(handle)['Count'])
-                if(totalStudies >= maxStudies):
-                    raise Exception(f"Too many studies in month! {year}/{month} num:{totalStudies}")
-
-                # get study ids
-                handle = Entrez.esearch(db='pubmed', retmax=maxStudies, term=monthQuery)
-                record = Entrez.read(handle)
-                id_list += record['IdList']
-
-                # make sure we have ALL studies
-                numStudiesMonth = len(record['IdList'])
-                if(numStudiesMonth != totalStudies):
-                    raise Exception(f"only have {numStudiesMonth}/{totalStudies} studies")
-                
-                break #next iteration
-            except Exception as e:
-                errorHandle(e)
-                pass #retry iteration
-
-# Remove duplicates by pmid
-id_list = list(set(id_list))
-print("Found ",len(id_list),"ids")
-
-# DataFrame to store the extracted data
-df = pd.DataFrame(columns=['PMID', 'Title', 'Abstract', 'Authors', 'Journal', 'Keywords', 'URL', 'Affiliations','pubDate','fullRecord'])
-
-# split list into chunks (for smooth progress)
-chunkSize = 500
-chunks = [id_list[i * chunkSize:(i + 1) * chunkSize] for i in range((len(id_list) + chunkSize - 1) // chunkSize )]
-
-# Fetch information for each record in the id_list
-for pmids in tqdm(chunks,desc="Getting individual article data",leave=True):
-    while True: #pause, wait for user, and retry on error
-        try:
-            handle = Entrez.efetch(db='pubmed', id=",".join(pmids), retmode='xml')
-            records = Entrez.read(handle)
-            break #next iteration
-        except Exception as e:
-            errorHandle(e)
-            pass #retry iteration
+chunkSize = 500 # studies per efetch
+
+# the search plan and fetched chunks are saved here as they complete, so a rerun skips work already done
+defaultCheckpointDir = "downloadCheckpoint"
+
+# write json so that the file is either complete or not there
+def writeJsonAtomic(path, obj):
+    with open(path + ".tmp", "w") as f:
+        json.dump(obj, f)
+    os.replace(path + ".tmp", path)
+
+# search plan of the query (date ranges under the cap, see searchPlanner), saved to planPath so a rerun doesn't search again
+# withIds also gets the pmids of each range (for --update)
+def getPlanCheckpointed(scheduler, planPath, withIds = False):
+    if os.path.exists(planPath):
+        with open(planPath) as f:
+            return [SearchRange.fromJson(saved) for saved in json.load(f)]
+
+    with tqdm(desc="Planning searches", unit="searches", leave=True) as progress:
+        ranges = planRanges(scheduler, full_query, date(startYear,1,1), date(endYear,12,31), withIds, progress=progress)
+    writeJsonAtomic(planPath, [searched.toJson() for searched in ranges])
+    print("Found",sum(searched.count for searched in ranges),"studies in",len(ranges),"date ranges")
+    return ranges
+
+# ranges of a saved plan have no history server search (they expire), so the ones with pages left to fetch are searched again
+# a range whose count changed since it was planned is planned again, the pages already fetched for a range that is searched
+# again are deleted either way (the new search doesn't have to list the studies in the same order, so they could overlap)
+def refreshRanges(scheduler, chunksDir, ranges):
+    stale = [searched for searched in ranges if searched.webEnv is None and not all(os.path.exists(path) for path in rangePagePaths(chunksDir, searched))]
+    fresh = scheduler.map(lambda searched: searchRange(scheduler, full_query, searched.start, searched.end), stale)
+    replaced = dict()
+    for old, new in tqdm(zip(stale, fresh), total=len(stale), desc="Searching unfinished ranges", leave=True):
+        shutil.rmtree(os.path.join(chunksDir, old.name()), ignore_errors=True)
+        if new.count == old.count:
+            replaced[id(old)] = [new]
+        else:
+            replaced[id(old)] = planRanges(scheduler, full_query, old.start, old.end, searched=new)
+    return [searched for old in ranges for searched in replaced.get(id(old), [old])]
+
+# delete the plan and fetched chunks saved in checkpointDir (only those, anything else put in the folder is left)
+def removeCheckpoint(checkpointDir):
+    planPath = os.path.join(checkpointDir, "plan.json")
+    if os.path.exists(planPath):
+        os.remove(planPath)
+    shutil.rmtree(os.path.join(checkpointDir, "chunks"), ignore_errors=True)
+    if not os.listdir(checkpointDir):
+        os.rmdir(checkpointDir)
+
+# Get IDs to process (matching query), from a plan searched withIds
+def getIds(ranges):
+    id_list = [pmid for searched in ranges for pmid in searched.ids]
+
+    # Remove duplicates by pmid
+    id_list = sorted(set(id_list), key=int)
+    print("Found ",len(id_list),"ids")
+    return id_list
+
+# parse an efetch response and stream its records into writer (column buffers written out in row groups), returns num records
+# keepFullRecord also stores each article's raw xml in the fullRecord column
+def extractChunk(xml, writer, keepFullRecord = False):
+    numRecords = 0
+    for row in iterRecords(io.BytesIO(xml), keepFullRecord):
+        writer.writeRow(row)
+        numRecords += 1
+    return numRecords
+
+# same as extractChunk through Entrez.read and extractRecord (the reference efetchParser is compared against in benchmark.py)
+def extractChunkEntrez(xml, writer):
+    records = Entrez.read(io.BytesIO(xml))
 
     # Process each PubMed article in the response
+    numRecords = 0
     for record in records['PubmedArticle']:
-        try:
-            pmid = record['MedlineCitation']['PMID']
-            url = f"https://www.ncbi.nlm.nih.gov/pubmed/{pmid}"
-        except:
-            pmid = ""
-            url = ""
-
-        # Print the record in a formatted JSON style
-        # print(json.dumps(record, indent=4, default=str))  # default=str handles types JSON can't serialize like datetime
-        try:
-            title = record['MedlineCitation']['Article']['ArticleTitle']
-        except:
-            title = ""
-
-        try:
-            abstract = ' '.join(record['MedlineCitation']['Article']['Abstract']['AbstractText'])
-        except:
-            abstract = ""
-
-        try:
-            authors = ', '.join(author.get('LastName', '') + ' ' + author.get('ForeName', '') for author in record['MedlineCitation']['Article']['AuthorList'])
-            
-            affiliations = []
-            for author in record['MedlineCitation']['Article']['AuthorList']:
-                if 'AffiliationInfo' in author and author['AffiliationInfo']:
-                    affiliations.append(author['AffiliationInfo'][0]['Affiliation'])
-            affiliations = '; '.join(set(affiliations))
-        except:
-            authors = ""
-            affiliations = ""
-            
-
-        try:
-            journal = record['MedlineCitation']['Article']['Journal']['Title']
-        except:
-            journal = ""
-        
-        try:
-            keywords = ', '.join(keyword['DescriptorName'] for keyword in record['MedlineCitation']['MeshHeadingList']) if 'MeshHeadingList' in record['MedlineCitation'] else ''
-        except:
-            keywords = ""
-        try:    
-            pubDate = json.dumps(record['MedlineCitation']['Article']['Journal']["JournalIssue"]["PubDate"])
-        except:
-            pubDate = ""
-            
-        new_row = pd.DataFrame({
-            'PMID': [pmid],
-            'Title': [title],
-            'Abstract': [abstract],
-            'Authors': [authors],
-            'Journal': [journal],
-            'Keywords': [keywords],
-            'URL': [url],
-            'Affiliations': [affiliations],
-            'pubDate': [pubDate],
-            'fullRecord': [json.dumps(record)]
-        })
-
-        df = pd.concat([df, new_row], ignore_index=True)
-
-# drop duplicate studies by pmid
-df.drop_duplicates(subset='PMID', inplace=True)
-# Save DataFrame to an Excel file
-df.to_excel('PubMed_results.xlsx', index=False)
\ No newline at end of file
+        writer.writeRow(extractRecord(record))
+        numRecords += 1
+    return numRecords
+
+# checkpoint file of a chunk, named by the ids in it
+def chunkPath(chunksDir, pmids):
+    return os.path.join(chunksDir, hashlib.sha1(",".join(pmids).encode()).hexdigest()[:20] + ".parquet")
+
+# checkpoint files of the efetch pages of a planned range
+def rangePagePaths(chunksDir, searched):
+    return [os.path.join(chunksDir, searched.name(), f"{retstart}.parquet") for retstart in pageStarts(searched.count, chunkSize)]
+
+# parse for EntrezScheduler.efetch: (xml, rows of its PubmedArticles), raises if the response doesn't have numRecords records
+# (PubmedArticles and PubmedBookArticles, which are not kept), like an ERROR response or a short page, so it is fetched again
+def pageParser(numRecords, keepFullRecord = False):
+    def parse(xml):
+        records = list(iterRecords(io.BytesIO(xml), keepFullRecord, withBooks=True))
+        if len(records) != numRecords:
+            raise Exception(f"got {len(records)} records, expected {numRecords}")
+        return xml, [row for row in records if row is not None]
+    return parse
+
+# save the rows of an efetch response of numRecords records to path (numRecords is kept in the file, see chunkRecords)
+# if saveXmlDir is given, the raw response is also kept there as xmlName (e.g. as a fixture for benchmark.py)
+def saveChunk(path, xml, rows, numRecords, xmlName, saveXmlDir = None):
+    if saveXmlDir is not None:
+        with open(os.path.join(saveXmlDir, xmlName), "wb") as f:
+            f.write(xml)
+
+    with CorpusWriter(path, metadata={"numRecords": str(numRecords)}) as writer:
+        writer.writeRows(rows)
+
+# number of records of the efetch response saved to path (its rows and the book articles that were not kept)
+def chunkRecords(path):
+    return int(readMetadata(path).get("numRecords", numRows(path)))
+
+# fetch a chunk of ids and save its records to path (skipped if already saved)
+def fetchChunkCheckpointed(scheduler, path, pmids, saveXmlDir = None, keepFullRecord = False):
+    if os.path.exists(path):
+        return
+    xml, rows = scheduler.efetch(pmids, parse=pageParser(len(pmids), keepFullRecord))
+    saveChunk(path, xml, rows, len(pmids), os.path.basename(path).replace(".parquet", ".xml"), saveXmlDir)
+
+# fetch the page of a planned range starting at retstart from the history server and save its records to path (skipped if already saved)
+def fetchPageCheckpointed(scheduler, path, searched, retstart, saveXmlDir = None, keepFullRecord = False):
+    if os.path.exists(path):
+        return
+    numRecords = min(chunkSize, searched.count-retstart)
+    xml, rows = scheduler.efetchHistory(searched.webEnv, searched.queryKey, retstart, chunkSize, parse=pageParser(numRecords, keepFullRecord))
+    saveChunk(path, xml, rows, numRecords, f"{searched.name()}_{retstart}.xml", saveXmlDir)
+
+# write the saved chunks (after the rows of existingCorpus, if given) to outputPath, dropping duplicate pmids
+# chunkGroups: lists of chunk paths, the rows of each group are written in pmid order (a group is at most one range, so it fits in memory)
+# groupCounts: number of distinct studies each group should have (the count of its range or its number of ids),
+# outputPath is left as it was if a group has a different number
+def assembleCorpus(chunkGroups, outputPath, existingCorpus = None, groupCounts = None):
+    seenPmids = set()
+    with CorpusWriter(outputPath) as writer:
+        if existingCorpus is not None:
+            for batch in iterBatches(existingCorpus):
+                seenPmids.update(batch['PMID'])
+                writer.writeColumns(batch)
+
+        for groupIndex, chunkPaths in enumerate(tqdm(chunkGroups, desc="Writing results", leave=True)):
+            group = dict()
+            numRecords = 0
+            for path in chunkPaths:
+                numRecords += chunkRecords(path)
+                for batch in iterBatches(path):
+                    for column, values in batch.items():
+                        group.setdefault(column, []).extend(values)
+            # book articles are counted in numRecords but have no rows, pmids saved twice (pages that overlap) count once
+            pmids = group.get('PMID', [])
+            numStudies = numRecords - len(pmids) + len(set(pmids))
+            if groupCounts is not None and numStudies != groupCounts[groupIndex]:
+                saved = os.path.dirname(chunkPaths[0]) if len(chunkPaths) > 1 else chunkPaths[0]
+                raise Exception(f"{saved} has {numStudies} distinct studies, expected {groupCounts[groupIndex]} (delete it and run again)")
+            if not group:
+                continue
+
+            # drop duplicate studies by pmid (keep first)
+            keep = []
+            for i in sorted(range(len(group['PMID'])), key=lambda i: (len(group['PMID'][i]), group['PMID'][i])):
+                pmid = group['PMID'][i]
+                if pmid not in seenPmids:
+                    seenPmids.add(pmid)
+                    keep.append(i)
+            writer.writeColumns({column: [values[i] for i in keep] for column, values in group.items()})
+
+    return writer.numRows
+
+# pull the columns we keep out of one PubmedArticle parsed by Entrez.read
+def extractRecord(record):
+    try:
+        pmid = record['MedlineCitation']['PMID']
+        url = f"https://www.ncbi.nlm.nih.gov/pubmed/{pmid}"
+    except:
+        pmid = ""
+        url = ""
+
+    # Print the record in a formatted JSON style
+    # print(json.dumps(record, indent=4, default=str))  # default=str handles types JSON can't serialize like datetime
+    try:
+        title = record['MedlineCitation']['Article']['ArticleTitle']
+    except:
+        title = ""
+
+    try:
+        abstract = ' '.join(record['MedlineCitation']['Article']['Abstract']['AbstractText'])
+    except:
+        abstract = ""
+
+    try:
+        authors = ', '.join(author.get('LastName', '') + ' ' + author.get('ForeName', '') for author in record['MedlineCitation']['Article']['AuthorList'])
+
+        affiliations = []
+        for author in record['MedlineCitation']['Article']['AuthorList']:
+            if 'AffiliationInfo' in author and author['AffiliationInfo']:
+                affiliations.append(author['AffiliationInfo'][0]['Affiliation'])
+        affiliations = '; '.join(set(affiliations))
+    except:
+        authors = ""
+        affiliations = ""
+
+
+    try:
+        journal = record['MedlineCitation']['Article']['Journal']['Title']
+    except:
+        journal = ""
+
+    try:
+        keywords = ', '.join(keyword['DescriptorName'] for keyword in record['MedlineCitation']['MeshHeadingList']) if 'MeshHeadingList' in record['MedlineCitation'] else ''
+    except:
+        keywords = ""
+    try:
+        pubDate = json.dumps(record['MedlineCitation']['Article']['Journal']["JournalIssue"]["PubDate"])
+    except:
+        pubDate = ""
+
+    return {
+        'PMID': pmid,
+        'Title': title,
+        'Abstract': abstract,
+        'Authors': authors,
+        'Journal': journal,
+        'Keywords': keywords,
+        'URL': url,
+        'Affiliations': affiliations,
+        'pubDate': pubDate,
+        'fullRecord': json.dumps(record)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the pubmed records matching the query")
+    parser.add_argument("--update", action="store_true", help=f"only fetch pmids not already in {defaultCorpusFile} and append them")
+    parser.add_argument("--checkpointDir", default=defaultCheckpointDir, help="where the search plan and fetched chunks are saved until the results are written")
+    parser.add_argument("--requestsPerSecond", type=float, default=None, help="request rate limit (default: 10 with an api key, 3 without)")
+    parser.add_argument("--maxInFlight", type=int, default=6, help="max concurrent requests")
+    parser.add_argument("--baseUrl", default=defaultBaseUrl, help="E-utilities base url (e.g. a local stub server for testing)")
+    parser.add_argument("--saveXmlDir", default=None, help="also save the raw efetch responses here")
+    parser.add_argument("--keepFullRecord", action="store_true", help="store each article's raw xml in the fullRecord column")
+    args = parser.parse_args()
+
+    # API key, allows 10 requests per second (without, its 3)
+    from apiKey import apiKey,email
+    scheduler = EntrezScheduler(email, apiKey, requestsPerSecond=args.requestsPerSecond, maxInFlight=args.maxInFlight, baseUrl=args.baseUrl)
+
+    # an update searches every range again (new studies show up in old months too), in its own checkpoint folder
+    checkpointDir = os.path.join(args.checkpointDir, "update") if args.update else args.checkpointDir
+    chunksDir = os.path.join(checkpointDir, "chunks")
+    os.makedirs(chunksDir, exist_ok=True)
+    if(args.saveXmlDir is not None):
+        os.makedirs(args.saveXmlDir, exist_ok=True)
+
+    planPath = os.path.join(checkpointDir, "plan.json")
+    ranges = getPlanCheckpointed(scheduler, planPath, withIds=args.update)
+
+    existingCorpus = None
+    if(args.update):
+        if(not os.path.exists(defaultCorpusFile)):
+            raise Exception(f"--update needs an existing {defaultCorpusFile}")
+        existingCorpus = defaultCorpusFile
+        existingPmids = set()
+        for batch in iterBatches(existingCorpus, columns=['PMID']):
+            existingPmids.update(batch['PMID'])
+        id_list = [pmid for pmid in getIds(ranges) if pmid not in existingPmids]
+        print(len(id_list), "new ids")
+
+        # only the new ids are fetched, so they are sent to efetch (split into chunks for smooth progress)
+        chunks = [id_list[i * chunkSize:(i + 1) * chunkSize] for i in range((len(id_list) + chunkSize - 1) // chunkSize )]
+        chunkPaths = [chunkPath(chunksDir, pmids) for pmids in chunks]
+        chunkGroups = [[path] for path in chunkPaths]
+        groupCounts = [len(pmids) for pmids in chunks]
+        todo = [(path, pmids) for path, pmids in zip(chunkPaths, chunks) if not os.path.exists(path)]
+        fetchChunk = lambda job: fetchChunkCheckpointed(scheduler, *job, saveXmlDir=args.saveXmlDir, keepFullRecord=args.keepFullRecord)
+    else:
+        # every study of a range is fetched, a page at a time from its search on the history server
+        ranges = refreshRanges(scheduler, chunksDir, ranges)
+        writeJsonAtomic(planPath, [searched.toJson() for searched in ranges])
+        chunkGroups = [rangePagePaths(chunksDir, searched) for searched in ranges]
+        groupCounts = [searched.count for searched in ranges]
+        todo = []
+        for searched, paths in zip(ranges, chunkGroups):
+            os.makedirs(os.path.join(chunksDir, searched.name()), exist_ok=True)
+            todo += [(path, searched, retstart) for path, retstart in zip(paths, pageStarts(searched.count, chunkSize)) if not os.path.exists(path)]
+        fetchChunk = lambda job: fetchPageCheckpointed(scheduler, *job, saveXmlDir=args.saveXmlDir, keepFullRecord=args.keepFullRecord)
+
+    numChunks = sum(len(paths) for paths in chunkGroups)
+    print(f"{numChunks-len(todo)}/{numChunks} chunks already fetched")
+
+    # Fetch information for each record
+    for _ in tqdm(scheduler.map(fetchChunk, todo), total=len(todo), desc="Getting individual article data", leave=True):
+        pass
+
+    print(f"Sent {scheduler.numRequests} requests ({scheduler.numRetries} retries)")
+
+    # Save to the columnar store
+    # every range (or chunk of new ids) has to have all its records, or the corpus is not written
+    numStudies = assembleCorpus(chunkGroups, defaultCorpusFile, existingCorpus, groupCounts)
+    print(f"Saved {numStudies} studies to {defaultCorpusFile}")
+
+    # the checkpoint is done with once the corpus is written: the next run (pull or update) has to search again,
+    # rebuilding the corpus from old pages would drop the studies an update appended since
+    removeCheckpoint(checkpointDir)
+
+    if(exportExcel):
+        exportToExcel(defaultCorpusFile, defaultExcelFile)
+
+if __name__ == "__main__":
+    main()
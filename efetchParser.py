@@ -0,0 +1,110 @@
+# streaming parser for efetch xml, pulls out only the columns we keep
+# gives the same values as downloadData.extractRecord on Entrez.read's records, without building Entrez's full object tree
+# each article element is released as soon as it is parsed
+import json
+import xml.etree.ElementTree as ET
+
+# inner text of a text element, child elements (e.g. <i>, <sup>) are kept as tags like Entrez.read does
+def rawText(elem, namespaces = ()):
+    parts = [elem.text or ""]
+    for child in elem:
+        name = child.tag
+        attrs = child.attrib
+        childNamespaces = namespaces
+        if name.startswith("{"):
+            uri, name = name[1:].split("}", 1)
+            if uri not in namespaces:
+                attrs = {"xmlns": uri}
+                childNamespaces = namespaces + (uri,)
+        tag = "<" + name + "".join(f' {key}="{value}"' for key, value in attrs.items()) + ">"
+        parts.append(tag + rawText(child, childNamespaces) + f"</{name}>" + (child.tail or ""))
+    return "".join(parts)
+
+def childText(elem, path):
+    child = elem.find(path)
+    return rawText(child) if child is not None else None
+
+# the columns we keep for one PubmedArticle element
+def extractArticle(article, keepFullRecord = False):
+    citation = article.find("MedlineCitation")
+
+    pmid = childText(citation, "PMID")
+    if pmid is None:
+        pmid = ""
+        url = ""
+    else:
+        url = f"https://www.ncbi.nlm.nih.gov/pubmed/{pmid}"
+
+    articleElem = citation.find("Article")
+    if articleElem is None:
+        articleElem = ET.Element("Article") #everything below is missing
+
+    title = childText(articleElem, "ArticleTitle") or ""
+
+    abstractElem = articleElem.find("Abstract")
+    abstract = ' '.join(rawText(text) for text in abstractElem.iterfind("AbstractText")) if abstractElem is not None else ""
+
+    authorList = articleElem.find("AuthorList")
+    authors = ""
+    affiliations = ""
+    if authorList is not None:
+        authorElems = authorList.findall("Author")
+        authors = ', '.join((childText(author, "LastName") or '') + ' ' + (childText(author, "ForeName") or '') for author in authorElems)
+
+        # first affiliation of each author, without duplicates
+        affiliations = dict()
+        for author in authorElems:
+            affiliationInfo = author.find("AffiliationInfo")
+            if affiliationInfo is None:
+                continue
+            affiliation = childText(affiliationInfo, "Affiliation")
+            if affiliation is None:
+                #extractRecord leaves both empty in this case
+                authors = ""
+                affiliations = dict()
+                break
+            affiliations[affiliation] = None
+        affiliations = '; '.join(affiliations)
+
+    journal = childText(articleElem, "Journal/Title") or ""
+
+    keywords = ""
+    meshHeadingList = citation.find("MeshHeadingList")
+    if meshHeadingList is not None:
+        descriptors = [childText(meshHeading, "DescriptorName") for meshHeading in meshHeadingList.iterfind("MeshHeading")]
+        keywords = ', '.join(descriptors) if None not in descriptors else ""
+
+    pubDateElem = articleElem.find("Journal/JournalIssue/PubDate")
+    pubDate = json.dumps({child.tag: rawText(child) for child in pubDateElem}) if pubDateElem is not None else ""
+
+    return {
+        'PMID': pmid,
+        'Title': title,
+        'Abstract': abstract,
+        'Authors': authors,
+        'Journal': journal,
+        'Keywords': keywords,
+        'URL': url,
+        'Affiliations': affiliations,
+        'pubDate': pubDate,
+        # raw article xml, only if asked for (the store compresses it)
+        'fullRecord': ET.tostring(article, encoding="unicode") if keepFullRecord else None
+    }
+
+# yield the row of each PubmedArticle in an efetch response (a binary file object)
+# withBooks also yields None for each PubmedBookArticle (not kept), to count every record of the response
+def iterRecords(source, keepFullRecord = False, withBooks = False):
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+
+        if elem.tag == "PubmedArticle":
+            yield extractArticle(elem, keepFullRecord)
+            root.clear() #release parsed articles
+        elif elem.tag == "PubmedBookArticle":
+            if withBooks:
+                yield None
+            root.clear() #not kept
@@ -0,0 +1,154 @@
+# concurrent, rate limited requests to the NCBI E-utilities
+# keeps several requests in flight under the api key's quota and retries with backoff on 400/429/5xx, broken connections
+# and responses that can't be read
+# baseUrl can point at a local stub server for testing
+import io
+import time
+import http.client
+import random
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from Bio import Entrez
+
+defaultBaseUrl = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+
+# status codes worth retrying (rate limited or server side problems, NCBI also gives 400 for some passing problems,
+# like a WebEnv the history server can't find for a moment)
+retryStatuses = {400, 429, 500, 502, 503, 504}
+
+# token bucket, acquire blocks until a request may be sent
+class TokenBucket:
+    def __init__(self, rate, capacity = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.lastRefill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now-self.lastRefill)*self.rate)
+                self.lastRefill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1-self.tokens)/self.rate
+            time.sleep(wait)
+
+# esearch response body -> parsed record, an esearch that failed on the server side (an ERROR in the result) raises
+def parseEsearch(body):
+    record = Entrez.read(io.BytesIO(body))
+    if "ERROR" in record:
+        raise Exception(f"esearch error: {record['ERROR']}")
+    return record
+
+class EntrezError(Exception):
+    def __init__(self, message, status = None):
+        super().__init__(message)
+        self.status = status
+
+class EntrezScheduler:
+    # requestsPerSecond defaults to NCBI's quota: 10 with an api key, 3 without
+    def __init__(self, email, apiKey = None, requestsPerSecond = None, maxInFlight = 6, maxTries = 8,
+                 backoff = 1.0, maxBackoff = 60.0, timeout = 120, baseUrl = defaultBaseUrl, tool = "PubmedUrologyWordCounter"):
+        if requestsPerSecond is None:
+            requestsPerSecond = 10 if apiKey else 3
+        self.email = email
+        self.apiKey = apiKey
+        self.tool = tool
+        self.baseUrl = baseUrl if baseUrl.endswith("/") else baseUrl+"/"
+        # capacity 1 so a burst can't go over the quota in any one second window
+        self.bucket = TokenBucket(requestsPerSecond, capacity=1)
+        self.maxInFlight = maxInFlight
+        self.maxTries = maxTries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.timeout = timeout
+        self.numRequests = 0
+        self.numRetries = 0
+        self.statsLock = threading.Lock()
+
+    # send one request (POST, so long id lists fit), returns the response body as bytes, or parse(body) if parse is given
+    # parse is retried along with the request: an exception from it (a cut off or error response) counts as a failed request
+    def request(self, util, params, parse = None):
+        params = dict(params)
+        params["tool"] = self.tool
+        params["email"] = self.email
+        if self.apiKey:
+            params["api_key"] = self.apiKey
+        data = urllib.parse.urlencode(params, doseq=True).encode()
+        url = self.baseUrl + util + ".fcgi"
+
+        for attempt in range(self.maxTries):
+            self.bucket.acquire()
+            with self.statsLock:
+                self.numRequests += 1
+            retryAfter = None
+            try:
+                with urllib.request.urlopen(url, data=data, timeout=self.timeout) as response:
+                    body = response.read()
+            except urllib.error.HTTPError as e:
+                if e.code not in retryStatuses:
+                    raise EntrezError(f"{util} failed with status {e.code}", e.code) from e
+                cause = e
+                error = EntrezError(f"{util} failed with status {e.code}", e.code)
+                retryAfter = e.headers.get("Retry-After") if e.headers is not None else None
+            except (urllib.error.URLError, http.client.HTTPException, TimeoutError, ConnectionError) as e:
+                cause = e
+                error = EntrezError(f"{util} failed: {e!r}")
+            else:
+                if parse is None:
+                    return body
+                try:
+                    return parse(body)
+                except Exception as e:
+                    cause = e
+                    error = EntrezError(f"{util} gave a response that can't be used: {e}")
+
+            if attempt == self.maxTries-1:
+                raise error from cause
+
+            # exponential backoff with jitter, or what the server asked for
+            wait = min(self.maxBackoff, self.backoff*2**attempt)*(0.5+random.random()/2)
+            if retryAfter is not None and retryAfter.isdigit():
+                wait = max(wait, float(retryAfter))
+            with self.statsLock:
+                self.numRetries += 1
+            time.sleep(wait)
+
+    # parsed esearch result (same as Entrez.read(Entrez.esearch(...))), read inside the retries
+    def esearch(self, **params):
+        params.setdefault("db", "pubmed")
+        return self.request("esearch", params, parseEsearch)
+
+    # raw efetch xml for a list of ids, or parse(xml) (see request)
+    def efetch(self, ids, parse = None, **params):
+        params.setdefault("db", "pubmed")
+        params.setdefault("retmode", "xml")
+        params["id"] = ",".join(ids)
+        return self.request("efetch", params, parse)
+
+    # raw efetch xml for retmax records from retstart of a search kept on the history server (esearch with usehistory="y"),
+    # or parse(xml) (see request)
+    def efetchHistory(self, webEnv, queryKey, retstart, retmax, parse = None, **params):
+        params.setdefault("db", "pubmed")
+        params.setdefault("retmode", "xml")
+        params.update(WebEnv=webEnv, query_key=queryKey, retstart=retstart, retmax=retmax)
+        return self.request("efetch", params, parse)
+
+    # like map(fn, items) with up to maxInFlight calls running at once, results come back in input order
+    def map(self, fn, items):
+        with ThreadPoolExecutor(self.maxInFlight) as pool:
+            pending = deque()
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= 2*self.maxInFlight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,97 @@
+# targeted counting for wordsWeWant runs: finds the wanted words and phrases in an abstract without building its token list
+# the terms are compiled into a trie of their words (an automaton over the normalized chunks of text), which is only walked from
+# chunks that start a term; the number of words in the abstract (the denominator of the percents) is counted from a code per chunk
+# single words give exactly what Tokenizer + filtering by wordsWeWant gives
+import re
+import json
+import hashlib
+import numpy as np
+from tokenizer import Tokenizer, ChunkTable, nonWordPattern, splitChunks, stripWord
+
+# wordsWeWant ("word,other word,...") as a list of terms, each a tuple of words
+# each comma separated part is one term, a part with several words is a phrase that has to appear in that order
+# single words are normalized like Tokenizer does (and dropped if it would drop them), phrases may contain any word
+# but need one word that is counted (not in wordsWeDontWant), else a study could mention the phrase while having no words
+# (percent of mentions over 0 words)
+def parseTerms(text, filterNums, wordsWeDontWant = ()):
+    tokenizer = Tokenizer(filterNums)
+    countedWords = Tokenizer(filterNums, wordsWeDontWant)
+    terms = dict() #keeps order, drops duplicates
+    for part in text.split(","):
+        words = [word for word in (stripWord(chunk) for chunk in nonWordPattern.sub(' ', part).lower().split()) if word != ""]
+        if len(words) == 1 and not tokenizer.keepWord(words[0]):
+            continue
+        if len(words) > 1 and not any(countedWords.keepWord(word) for word in words):
+            raise Exception(f"Phrase '{termName(words)}' is only made of filtered out words, add a counted word to it")
+        if words:
+            terms[tuple(words)] = None
+    return list(terms)
+
+# chunk codes (see PhraseMatcher.chunkCode) of chunks that start a term
+termStartCodes = re.compile(rb"[\x02\x03]")
+
+# name of a term in the output
+def termName(term):
+    return " ".join(term)
+
+class PhraseMatcher:
+    # terms: from parseTerms, filterNums and wordsWeDontWant: as for Tokenizer (they only change the number of words)
+    def __init__(self, terms, filterNums, wordsWeDontWant = ()):
+        self.terms = terms
+        self.tokenizer = Tokenizer(filterNums, wordsWeDontWant)
+
+        # trie of the terms' words: word -> [child trie, name of the term ending here or None]
+        self.trie = dict()
+        for term in terms:
+            node = self.trie
+            for i, word in enumerate(term):
+                entry = node.setdefault(word, [dict(), None])
+                if i == len(term)-1:
+                    entry[1] = termName(term)
+                node = entry[0]
+
+        # per chunk: its stripped word, and its code
+        self.chunkWords = ChunkTable(stripWord)
+        self.chunkCodes = ChunkTable(self.chunkCode)
+        self.maxCacheSize = self.tokenizer.maxCacheSize
+
+    # 1 if the chunk counts as a word, plus 2 if a term starts with it
+    def chunkCode(self, chunk):
+        word = self.chunkWords[chunk]
+        return (1 if self.tokenizer.keepWord(word) else 0) | (2 if word in self.trie else 0)
+
+    # hash of everything that changes which terms come out, to tell when saved results are stale
+    def configHash(self):
+        return hashlib.sha1(json.dumps([self.tokenizer.configHash(), self.terms]).encode()).hexdigest()
+
+    # (list of the terms in text in order, a term inside a longer one is counted too, number of words in text)
+    def tokenizeWithCount(self, text):
+        if len(self.chunkWords) > self.maxCacheSize:
+            self.chunkWords.clear()
+            self.chunkCodes.clear()
+
+        # one byte per chunk, so counting and finding term starts runs in C
+        chunks = splitChunks(text)
+        codes = bytes(map(self.chunkCodes.__getitem__, chunks))
+        numWords = codes.count(1) + codes.count(3)
+
+        words = []
+        chunkWords = self.chunkWords
+        numChunks = len(chunks)
+        for match in termStartCodes.finditer(codes):
+            node = self.trie
+            for i in range(match.start(), numChunks):
+                entry = node.get(chunkWords[chunks[i]])
+                if entry is None:
+                    break
+                node, name = entry
+                if name is not None:
+                    words.append(name)
+                if not node:
+                    break
+        return words, numWords
+
+    # (int32 array of the ids of the terms in text, number of words in text), new terms are added to vocab (dict of term -> id)
+    def tokenizeIds(self, text, vocab):
+        words, numWords = self.tokenizeWithCount(text)
+        return np.array([vocab.setdefault(word, len(vocab)) for word in words], dtype=np.int32), numWords
@@ -0,0 +1,88 @@
+# plans the esearch side of a download: which publication date ranges to fetch
+# each range is searched once (usehistory=y, so its results can be paged with efetch from the history server),
+# ranges with more studies than esearch/efetch can page through are split (in parts sized by their count) and searched
+# again, empty ranges are dropped
+import math
+from datetime import date, timedelta
+
+maxStudies = 9999 # imposed by API (a range must have fewer studies than this)
+
+# a date range and what its esearch found
+class SearchRange:
+    def __init__(self, start, end, count, webEnv = None, queryKey = None, ids = None):
+        self.start = start
+        self.end = end
+        self.count = count
+        self.webEnv = webEnv #history server handle of the search, None if it was not searched in this run
+        self.queryKey = queryKey
+        self.ids = ids #pmids, if the search asked for them
+
+    # name of the range (and its count, so pages saved for a different result set are never mixed in)
+    def name(self):
+        return f"{self.start:%Y%m%d}-{self.end:%Y%m%d}-{self.count}"
+
+    def toJson(self):
+        saved = {"start": self.start.isoformat(), "end": self.end.isoformat(), "count": self.count}
+        if self.ids is not None:
+            saved["ids"] = self.ids
+        return saved
+
+    @classmethod
+    def fromJson(cls, saved):
+        return cls(date.fromisoformat(saved["start"]), date.fromisoformat(saved["end"]), saved["count"], ids=saved.get("ids"))
+
+# order of the results of a search (efetch pages are slices of it), asked for explicitly instead of relying on the default
+searchSort = "pub_date"
+
+def rangeTerm(query, start, end):
+    return query + f' AND ({start:%Y/%m/%d}:{end:%Y/%m/%d}[pdat])'
+
+# esearch one date range, keeping the results on the history server
+# withIds also gets the pmids in the same request (all of them if the range is under the cap)
+def searchRange(scheduler, query, start, end, withIds = False):
+    record = scheduler.esearch(term=rangeTerm(query, start, end), usehistory="y", retmax=maxStudies if withIds else 0, sort=searchSort)
+    searched = SearchRange(start, end, int(record['Count']), record.get('WebEnv'), record.get('QueryKey'))
+    if withIds and searched.count < maxStudies:
+        searched.ids = list(record['IdList'])
+        # make sure we have ALL studies
+        if len(searched.ids) != searched.count:
+            raise Exception(f"only have {len(searched.ids)}/{searched.count} studies for {start}:{end}")
+    return searched
+
+# parts of a range with count studies, about half the cap each (so most parts don't need another split)
+def splitRange(start, end, count):
+    numDays = (end-start).days + 1
+    numParts = min(numDays, max(2, math.ceil(2*count/maxStudies)))
+    bounds = [start + timedelta(days=numDays*i//numParts) for i in range(numParts+1)]
+    return [(bounds[i], bounds[i+1]-timedelta(days=1)) for i in range(numParts)]
+
+# the ranges, in date order, that together cover start:end, each with fewer studies than the cap and at least one
+# searches one level of splits at a time, the searches of a level run concurrently (scheduler.map)
+# searched: already made search of start:end, if any
+def planRanges(scheduler, query, start, end, withIds = False, searched = None, progress = None):
+    planned = []
+    toSearch = [(start, end)]
+    found = [searched] if searched is not None else None
+    while toSearch:
+        if found is None:
+            found = list(scheduler.map(lambda dates: searchRange(scheduler, query, *dates, withIds), toSearch))
+        nextSearch = []
+        for searched in found:
+            if progress is not None:
+                progress.update(1)
+            if searched.count == 0:
+                continue
+            if searched.count < maxStudies:
+                planned.append(searched)
+            elif searched.start == searched.end:
+                raise Exception(f"Too many studies on one day! {searched.start} num:{searched.count}")
+            else:
+                nextSearch += splitRange(searched.start, searched.end, searched.count)
+        toSearch = nextSearch
+        found = None
+
+    return sorted(planned, key=lambda searched: searched.start)
+
+# retstart of each efetch page of a range
+def pageStarts(count, pageSize):
+    return list(range(0, count, pageSize))
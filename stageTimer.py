@@ -0,0 +1,68 @@
+# wall time, peak memory and throughput of the stages of a run
+# databaseWordCounter.py records its stages in otherData.txt, benchmark.py in its results file
+import sys
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None #not available on windows, peak memory is left out there
+
+# VmHWM (peak) and VmRSS (current) resident memory of this process in MB from /proc, None where there is no /proc (not linux)
+def procStatusMb():
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if line.startswith(("VmHWM", "VmRSS")))
+        return int(status["VmHWM"].split()[0])/2**10, int(status["VmRSS"].split()[0])/2**10
+    except (OSError, KeyError, ValueError):
+        return None
+
+# start a new peak: sets the high water mark back to the current resident memory, False if that can't be done here
+# (linux only, writing 5 to clear_refs resets VmHWM, the getrusage peak can't be reset)
+def resetPeakRss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return procStatusMb() is not None
+
+# peak resident memory of this process in MB (since the last resetPeakRss), None if it can't be measured
+def peakRssMb():
+    status = procStatusMb()
+    if status is not None:
+        return status[0]
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kilobytes on linux, bytes on macos
+    return peak/2**20 if sys.platform == "darwin" else peak/2**10
+
+class StageTimer:
+    def __init__(self):
+        self.stages = dict() #stage name -> stats, in the order the stages ran
+
+    # time the body of the with block as stage name
+    # set record[unit] to the number of things the stage processed to also get its throughput
+    # peak memory is the process' high water mark during the stage (on linux, elsewhere since the process started, which
+    # includes imports and earlier stages), growth is how far it went over the memory held when the stage started
+    @contextmanager
+    def stage(self, name, unit = "items"):
+        record = dict()
+        if resetPeakRss():
+            peakBefore = procStatusMb()[1]
+        else:
+            peakBefore = peakRssMb()
+        startTime = time.perf_counter()
+        yield record
+        seconds = time.perf_counter()-startTime
+        peakAfter = peakRssMb()
+
+        stats = {"seconds": round(seconds, 4)}
+        if peakAfter is not None:
+            stats["peak_rss_mb"] = round(peakAfter, 1)
+            stats["peak_rss_growth_mb"] = round(peakAfter-peakBefore, 1)
+        if unit in record:
+            stats[unit] = record[unit]
+            stats[unit + "_per_second"] = round(record[unit]/seconds, 1) if seconds > 0 else None
+        self.stages[name] = stats
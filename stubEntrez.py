@@ -0,0 +1,183 @@
+# local stub of the E-utilities esearch/efetch that downloadData.py uses, for trying the download without NCBI
+# python stubEntrez.py --numArticles 100000 --denseMonth 2020/3:12000 --failRate 0.05
+# python downloadData.py --baseUrl http://127.0.0.1:8765/ --requestsPerSecond 100
+# articles are benchmark.syntheticArticle with a random publication date, esearch understands the "YYYY/MM/DD:YYYY/MM/DD[pdat]"
+# date range of downloadData.py's terms (the rest of the query is ignored), keeps searches on a history server
+# (usehistory=y, WebEnv/query_key) and like NCBI only pages through the first 9,999 results of a search
+# failure injection: a share (failRate) of requests fails in one of the ways NCBI can (see failKinds)
+# request and failure counts are at http://127.0.0.1:8765/stats
+import re
+import json
+import random
+import argparse
+import threading
+from datetime import date
+from urllib.parse import parse_qs, urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from benchmark import syntheticArticle, efetchHeader
+
+# ways a request can fail
+# status: 429/500/502/503 (rate limited, server side problems), status400: 400 (NCBI gives these for passing problems too),
+# error: status 200 with an ERROR in the body, incomplete: the connection is closed part way through the body,
+# truncated: a complete response of only part of the body, short: an efetch page with some of its records left out
+failKinds = ("status", "status400", "error", "incomplete", "truncated", "short")
+
+# how far esearch/efetch page into the results of a search (retstart past this is a 400, as on NCBI)
+maxRetstart = 9998
+
+esearchHeader = ('<?xml version="1.0" encoding="UTF-8" ?>\n<!DOCTYPE eSearchResult PUBLIC "-//NLM//DTD esearch 20060628//EN" '
+                 '"https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20060628/esearch.dtd">\n')
+
+datePattern = re.compile(r"(\d{4})/(\d{1,2})(?:/(\d{1,2}))?:(\d{4})/(\d{1,2})(?:/(\d{1,2}))?\[pdat\]")
+
+# pmid -> publication date of numArticles articles from startYear to endYear, plus denseCount more in one month (to need splits)
+def makeArticles(numArticles, startYear, endYear, denseMonth = None, denseCount = 0, seed = 0):
+    rand = random.Random(seed)
+    articles = dict()
+    for i in range(numArticles):
+        articles[str(1000+i)] = date(rand.randint(startYear, endYear), rand.randint(1, 12), rand.randint(1, 28))
+    if denseMonth is not None:
+        for i in range(denseCount):
+            articles[str(90000000+i)] = date(denseMonth[0], denseMonth[1], rand.randint(1, 28))
+    return articles
+
+class StubEntrez:
+    def __init__(self, articles, failRate = 0.0, kinds = failKinds, seed = 0):
+        self.articles = articles
+        self.failRate = failRate
+        self.kinds = kinds
+        self.rand = random.Random(seed)
+        self.history = dict() #query_key -> pmids of the search
+        self.stats = dict()
+        self.lock = threading.Lock()
+
+    def count(self, key):
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    # pmids matching term, newest first like PubMed
+    def search(self, term):
+        match = datePattern.search(term)
+        pmids = list(self.articles)
+        if match is not None:
+            startYear, startMonth, startDay, endYear, endMonth, endDay = match.groups()
+            # as (year, month, day) since a range can end on day 31 of any month
+            start = (int(startYear), int(startMonth), int(startDay or 1))
+            end = (int(endYear), int(endMonth), int(endDay or 31))
+            pmids = [pmid for pmid in pmids if start <= self.articles[pmid].timetuple()[:3] <= end]
+        return sorted(pmids, key=int, reverse=True)
+
+    # (status, body) of a request, and the failure injected into it (None, or one of failKinds)
+    def handle(self, util, params):
+        with self.lock:
+            self.count(util)
+            failure = self.rand.choice(self.kinds) if util in ("esearch", "efetch") and self.rand.random() < self.failRate else None
+            if failure == "short" and util != "efetch":
+                failure = None
+            if failure is not None:
+                self.count("fail_" + failure)
+
+        if util == "stats":
+            return 200, json.dumps(self.stats).encode(), None
+        if failure == "status":
+            return self.rand.choice((429, 500, 502, 503)), b"busy", None
+        if failure == "status400":
+            return 400, b"bad request", None
+
+        if util == "esearch":
+            if failure == "error":
+                return 200, (esearchHeader + "<eSearchResult><ERROR>Search Backend failed</ERROR></eSearchResult>\n").encode(), None
+            pmids = self.search(params.get("term", ""))
+            retstart = int(params.get("retstart", 0))
+            retmax = int(params.get("retmax", 20))
+            if retstart > maxRetstart:
+                return 400, b"retstart too big", None
+            page = pmids[retstart:min(retstart+retmax, maxRetstart+1)]
+            history = ""
+            if params.get("usehistory") == "y":
+                with self.lock:
+                    queryKey = str(len(self.history)+1)
+                    self.history[queryKey] = pmids
+                history = f"<QueryKey>{queryKey}</QueryKey><WebEnv>STUB_{queryKey}</WebEnv>"
+            ids = "".join(f"<Id>{pmid}</Id>" for pmid in page)
+            body = (esearchHeader + f"<eSearchResult><Count>{len(pmids)}</Count><RetMax>{len(page)}</RetMax><RetStart>{retstart}</RetStart>"
+                    f"{history}<IdList>{ids}</IdList><TranslationSet/><QueryTranslation>stub</QueryTranslation></eSearchResult>\n")
+            return 200, body.encode(), failure
+
+        if util == "efetch":
+            if failure == "error":
+                return 200, b'<?xml version="1.0" encoding="UTF-8" ?>\n<eFetchResult><ERROR>Unable to obtain query #1</ERROR></eFetchResult>\n', None
+            if "id" in params:
+                pmids = [pmid for pmid in params["id"].split(",") if pmid in self.articles]
+            else:
+                retstart = int(params.get("retstart", 0))
+                if retstart > maxRetstart or params.get("query_key") not in self.history:
+                    return 400, b"bad request", None
+                pmids = self.history[params["query_key"]][retstart:min(retstart+int(params.get("retmax", 20)), maxRetstart+1)]
+            if failure == "short":
+                pmids = pmids[:len(pmids)//2]
+            articles = "".join(syntheticArticle(int(pmid), self.articles[pmid].timetuple()[:3]) for pmid in pmids)
+            return 200, (efetchHeader + articles + "</PubmedArticleSet>\n").encode(), failure
+
+        return 404, b"unknown util", None
+
+def makeHandler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.respond(parse_qs(urlparse(self.path).query))
+
+        def do_POST(self):
+            self.respond(parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()))
+
+        def respond(self, query):
+            util = urlparse(self.path).path.rstrip("/").rsplit("/", 1)[-1].replace(".fcgi", "")
+            status, body, failure = stub.handle(util, {key: values[0] for key, values in query.items()})
+            length = len(body)
+            if failure == "truncated":
+                body = body[:len(body)//2]
+                length = len(body)
+            elif failure == "incomplete":
+                body = body[:len(body)//2]
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json" if util == "stats" else "text/xml")
+            self.send_header("Content-Length", str(length))
+            if failure == "incomplete":
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+            if failure == "incomplete":
+                self.close_connection = True
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the E-utilities for trying downloadData.py")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--numArticles", type=int, default=100000, help="articles spread over startYear to endYear")
+    parser.add_argument("--startYear", type=int, default=1950)
+    parser.add_argument("--endYear", type=int, default=2025)
+    parser.add_argument("--denseMonth", default=None, help="YYYY/MM:count, that many more articles in one month (over 9,999 the planner has to split it)")
+    parser.add_argument("--failRate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--failKinds", default=",".join(failKinds), help=f"comma separated ways requests fail, some of {','.join(failKinds)}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    kinds = tuple(kind.strip() for kind in args.failKinds.split(",") if kind.strip())
+    unknownKinds = set(kinds) - set(failKinds)
+    if unknownKinds or not kinds:
+        raise Exception(f"Unknown --failKinds {sorted(unknownKinds)}, expected some of {failKinds}")
+
+    denseMonth, denseCount = None, 0
+    if args.denseMonth is not None:
+        month, denseCount = args.denseMonth.split(":")
+        denseMonth = tuple(int(part) for part in month.split("/"))
+        denseCount = int(denseCount)
+
+    articles = makeArticles(args.numArticles, args.startYear, args.endYear, denseMonth, denseCount, args.seed)
+    stub = StubEntrez(articles, args.failRate, kinds, args.seed)
+    print(f"Serving {len(articles)} articles on http://127.0.0.1:{args.port}/")
+    ThreadingHTTPServer(("127.0.0.1", args.port), makeHandler(stub)).serve_forever()
+
+if __name__ == "__main__":
+    main()
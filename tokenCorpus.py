@@ -0,0 +1,131 @@
+# the parsed corpus as word ids: one vocabulary plus flat arrays (CSR style) instead of a list of word lists per paper
+# tokens[offsets[i]:offsets[i+1]] are the word ids of study i, years[i] its year, numWords[i] its number of words
+# (numWords is len of its tokens, except with a PhraseMatcher where tokens only hold the wanted terms)
+# can be saved to a folder of .npy files and memory mapped back
+import os
+import json
+from array import array
+import numpy as np
+
+tokenArrays = ("tokens", "offsets", "years", "numWords")
+
+# write(f) to path + ".tmp" (a binary file) and put it in place of path once it is complete
+# (a memory mapped old version keeps working, it is a different file)
+def writeFileAtomic(path, write):
+    with open(path + ".tmp", "wb") as f:
+        write(f)
+    os.replace(path + ".tmp", path)
+
+class TokenCorpus:
+    def __init__(self, vocab, tokens, offsets, years, numWords):
+        self.vocab = vocab #list of words, ids index into it
+        self.tokens = tokens
+        self.offsets = offsets
+        self.years = years
+        self.numWords = numWords
+
+    def __len__(self):
+        return len(self.years)
+
+    # (first study, end study) ranges of at most maxTokens tokens (or one study, if it alone has more)
+    def studyBlocks(self, maxTokens):
+        start = 0
+        while start < len(self):
+            end = int(np.searchsorted(self.offsets, self.offsets[start]+maxTokens, side="right"))-1
+            end = min(max(end, start+1), len(self))
+            yield start, end
+            start = end
+
+    # word ids of studies start:end with the study (index from start) of each, for a block from studyBlocks
+    def blockTokens(self, start, end):
+        offsets = self.offsets
+        tokens = np.asarray(self.tokens[offsets[start]:offsets[end]], dtype=np.int64)
+        studyOfToken = np.repeat(np.arange(end-start), np.diff(offsets[start:end+1]))
+        return tokens, studyOfToken
+
+    # (first study, end study, word ids, study of each) of blocks of at most maxTokens tokens
+    def iterBlocks(self, maxTokens):
+        for start, end in self.studyBlocks(maxTokens):
+            yield (start, end) + self.blockTokens(start, end)
+
+    # (sorted distinct years, index of each study's year in them, number of studies in each year)
+    def yearGroups(self):
+        years, yearIndex = np.unique(np.asarray(self.years), return_inverse=True)
+        return years, yearIndex, np.bincount(yearIndex, minlength=len(years))
+
+    # ids of the given words (words not in the corpus are left out)
+    def wordIdsOf(self, words):
+        wordIds = {word: wordId for wordId, word in enumerate(self.vocab)}
+        return np.array([wordIds[word] for word in words if word in wordIds], dtype=np.int64)
+
+    # boolean array over the vocabulary, True for the given words (None means all words)
+    def wordMask(self, words = None):
+        if words is None:
+            return np.ones(len(self.vocab), dtype=bool)
+        mask = np.zeros(len(self.vocab), dtype=bool)
+        mask[self.wordIdsOf(words)] = True
+        return mask
+
+    # save to directory, meta (a dict) is saved beside the arrays to tell later runs what the corpus was built from
+    # directory has to be new, empty or hold a saved corpus, only the corpus' own files
+    # (the tokenArrays .npy files, vocab.json and meta.json) are written in it, nothing else there is touched
+    def save(self, directory, meta = None):
+        TokenCorpus.checkSaveDirectory(directory)
+        os.makedirs(directory, exist_ok=True)
+        metaPath = os.path.join(directory, "meta.json")
+
+        # meta.json is taken out first and written last, so a save that is cut off is never read as a saved corpus
+        if os.path.exists(metaPath):
+            os.remove(metaPath)
+        for name in tokenArrays:
+            writeFileAtomic(os.path.join(directory, name + ".npy"), lambda f: np.save(f, getattr(self, name)))
+        writeFileAtomic(os.path.join(directory, "vocab.json"), lambda f: f.write(json.dumps(self.vocab, ensure_ascii=False).encode("utf-8")))
+        writeFileAtomic(metaPath, lambda f: f.write(json.dumps(meta or dict()).encode()))
+
+    # raises if directory has files that are not a saved corpus (save would mix the corpus in with them)
+    @staticmethod
+    def checkSaveDirectory(directory):
+        if os.path.isdir(directory) and os.listdir(directory) and not os.path.exists(os.path.join(directory, "meta.json")):
+            raise Exception(f"{directory} has files but no saved corpus, pick a new or empty folder to save the corpus to")
+        if os.path.exists(directory) and not os.path.isdir(directory):
+            raise Exception(f"{directory} is a file, pick a new or empty folder to save the corpus to")
+
+    # the arrays are memory mapped unless mmap is False (only the pages that are read take memory)
+    @classmethod
+    def load(cls, directory, mmap = True):
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None) for name in tokenArrays}
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(vocab, **arrays)
+
+    # meta saved with the corpus, None if there is no saved corpus
+    @staticmethod
+    def readMeta(directory):
+        path = os.path.join(directory, "meta.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+# collects studies into a TokenCorpus, vocab is the dict of word -> id the tokenizer adds new words to
+class TokenCorpusBuilder:
+    def __init__(self):
+        self.vocab = dict()
+        self.tokens = array("i")
+        self.offsets = array("q", [0])
+        self.years = array("i")
+        self.numWords = array("i")
+
+    # ids: int32 array of the study's word ids
+    def addStudy(self, year, ids, numWords):
+        self.tokens.frombytes(ids.tobytes())
+        self.offsets.append(len(self.tokens))
+        self.years.append(year)
+        self.numWords.append(numWords)
+
+    def finish(self):
+        return TokenCorpus(list(self.vocab),
+                           np.frombuffer(self.tokens, dtype=np.int32),
+                           np.frombuffer(self.offsets, dtype=np.int64),
+                           np.frombuffer(self.years, dtype=np.int32),
+                           np.frombuffer(self.numWords, dtype=np.int32))
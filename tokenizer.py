@@ -0,0 +1,209 @@
+# fast tokenizer giving the same words as databaseWordCounter.getWords
+# run this file to check it against getWords on the corpus
+import re
+import sys
+import json
+import hashlib
+import numpy as np
+
+# everything but words, digits, whitespace, apostrophe, and dash
+nonWordPattern = re.compile(r"[^\w\d\s'-]+")
+
+# bytes.translate table doing for ascii what nonWordPattern.sub does (whitespace bytes.split does not know becomes a space too)
+asciiTable = bytes(32 if nonWordPattern.match(chr(code)) or chr(code).isspace() else code for code in range(128)) + bytes(range(128, 256))
+asciiBytes = bytes(range(128))
+
+# non ascii char -> (whether it is taken out like nonWordPattern does or is whitespace, whether lower() changes it)
+nonAsciiChars = dict()
+
+# bump when the tokenizing rules change, so saved results (e.g. wordIndex.py) are rebuilt
+tokenizerVersion = 1
+
+# a whitespace separated chunk of (lowercased) text without the 's at its end and the apostrophes/dashes around it
+def stripWord(word):
+    # get rid of 's at END of words
+    if word.endswith("'s"):
+        word = word[:-2]
+
+    # remove apostrophes or dashes at begining/end
+    return word.strip("-'")
+
+# lowercased whitespace separated chunks of text, with everything but words, digits, apostrophes and dashes taken out
+# (same as nonWordPattern.sub(' ', text).lower().split()) the text is split as utf-8 bytes, which is several times faster than the regex,
+# so chunks are bytes, or str if lowercasing needs more than ascii
+def splitChunks(text):
+    data = text.encode().translate(asciiTable)
+    if text.isascii():
+        return data.lower().split()
+
+    # only the few distinct non ascii chars are looked at
+    lowerAll = False
+    for char in set(data.translate(None, asciiBytes).decode()):
+        info = nonAsciiChars.get(char)
+        if info is None:
+            info = nonAsciiChars[char] = (nonWordPattern.match(char) is not None or char.isspace(), char.lower() != char)
+        if info[0]:
+            data = data.replace(char.encode(), b' ')
+        elif info[1]:
+            lowerAll = True
+    if lowerAll:
+        return data.decode().lower().split()
+    return data.lower().split()
+
+# dict of chunk -> compute(chunk as str), filled in the first time a chunk is looked up
+# so map(table.__getitem__, chunks) stays in C for chunks seen before
+class ChunkTable(dict):
+    def __init__(self, compute):
+        super().__init__()
+        self.compute = compute
+
+    def __missing__(self, chunk):
+        value = self[chunk] = self.compute(chunk if isinstance(chunk, str) else chunk.decode())
+        return value
+
+class Tokenizer:
+    def __init__(self, filterNums, wordsWeDontWant = ()):
+        self.filterNums = filterNums
+        self.wordsWeDontWant = frozenset(wordsWeDontWant)
+        self.cache = ChunkTable(self.chunkWord) #whitespace separated chunk -> word ("" if it is filtered out)
+        self.maxCacheSize = 2000000
+        self.idVocab = None #vocab the id cache gives ids from (see tokenizeIds)
+        self.idCache = None #whitespace separated chunk -> word id (-1 if it is filtered out)
+
+    # hash of everything that changes which words come out, to tell when saved results are stale
+    def configHash(self):
+        config = {"version": tokenizerVersion, "filterNums": self.filterNums, "wordsWeDontWant": sorted(self.wordsWeDontWant)}
+        return hashlib.sha1(json.dumps(config).encode()).hexdigest()
+
+    # word a single whitespace separated chunk of (lowercased) text turns into, None if it is filtered out
+    def normalizeWord(self, word):
+        word = stripWord(word)
+        return word if self.keepWord(word) else None
+
+    def chunkWord(self, chunk):
+        return self.normalizeWord(chunk) or ""
+
+    def chunkId(self, chunk):
+        word = self.normalizeWord(chunk)
+        return -1 if word is None else self.idVocab.setdefault(word, len(self.idVocab))
+
+    # whether a stripped word is kept as a token
+    def keepWord(self, word):
+        # remove one (or zero (can happen due to previous filters)) letter words
+        if len(word) <= 1:
+            return False
+
+        # get rid of numbers or numbers seperated by dashes
+        # (getWords drops these even when filterNums is false, because of operator precedence, kept for identical output)
+        if word.replace('-','').isnumeric():
+            return False
+
+        # get rid of words we dont want
+        if word in self.wordsWeDontWant:
+            return False
+
+        return True
+
+    # list of words in text
+    def tokenize(self, text):
+        cache = self.cache
+        if len(cache) > self.maxCacheSize:
+            cache.clear()
+        return list(filter(None, map(cache.__getitem__, splitChunks(text))))
+
+    # (list of words in text, number of words in text)
+    def tokenizeWithCount(self, text):
+        words = self.tokenize(text)
+        return words, len(words)
+
+    # (int32 array of the ids of the words in text, number of words in text), new words are added to vocab (dict of word -> id)
+    def tokenizeIds(self, text, vocab):
+        if vocab is not self.idVocab or len(self.idCache) > self.maxCacheSize:
+            self.idVocab = vocab
+            self.idCache = ChunkTable(self.chunkId)
+        chunks = splitChunks(text)
+        ids = np.fromiter(map(self.idCache.__getitem__, chunks), dtype=np.int32, count=len(chunks))
+        ids = ids[ids >= 0]
+        return ids, len(ids)
+
+    # tokenize many texts, yields lists of words
+    # if vocab (dict of word -> id) is given, yields int32 arrays of ids instead, adding new words to vocab
+    def tokenizeMany(self, texts, vocab = None):
+        for text in texts:
+            if vocab is None:
+                yield self.tokenize(text)
+            else:
+                yield self.tokenizeIds(text, vocab)[0]
+
+# chars that make tokenizing hard: non ascii whitespace and separators python splits on, chars whose lowercase is longer or
+# context dependent, non ascii digits/letters/marks, punctuation nonWordPattern takes out and the apostrophes/dashes it keeps
+fuzzChars = (" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2028\u2029\u202f\u3000"
+             "İIıiΣσςßẞǅǄﬁKΩÅµ"
+             "éÉñüÜçøæ\u0301\u0308漢字😀٣²½Ⅻ"
+             ".,;:!?()[]/\\\"&%+=*_@#<>\u2013\u2014\u2019"
+             "'-")
+
+# seeded random texts of words made of ascii and fuzzChars, for checking Tokenizer without a corpus
+def fuzzTexts(numTexts, seed = 0):
+    import random
+    rng = random.Random(seed)
+    asciiChars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    texts = []
+    for _ in range(numTexts):
+        words = []
+        for _ in range(rng.randint(0, 30)):
+            word = "".join(rng.choice(fuzzChars) if rng.random() < 0.3 else rng.choice(asciiChars) for _ in range(rng.randint(1, 8)))
+            words.append(word + ("'s" if rng.random() < 0.1 else ""))
+        texts.append(rng.choice(fuzzChars[:18]).join(words) if rng.random() < 0.3 else " ".join(words))
+    return texts
+
+# check Tokenizer against getWords on every text (and on the filter list), and splitChunks against the regex it replaces
+# getTexts gives an iterable of texts, it is called once per filterNums setting
+def checkConformance(getTexts):
+    from databaseWordCounter import getWords
+    from wordsToFilterList import wordsToFilterList
+
+    numChecked = 0
+    numMismatches = 0
+    for filterNums in (True, False):
+        wordsWeDontWant = set(getWords(wordsToFilterList, filterNums))
+        if set(Tokenizer(filterNums).tokenize(wordsToFilterList)) != wordsWeDontWant:
+            raise Exception("Tokenizer does not match getWords on wordsToFilterList")
+
+        tokenizer = Tokenizer(filterNums, wordsWeDontWant)
+        for text in getTexts():
+            text = str(text)
+            numChecked += 1
+            chunks = [chunk if isinstance(chunk, str) else chunk.decode() for chunk in splitChunks(text)]
+            if tokenizer.tokenize(text) != getWords(text, filterNums, wordsWeDontWant) or chunks != nonWordPattern.sub(' ', text).lower().split():
+                numMismatches += 1
+                print("Mismatch:", repr(text[:200]))
+
+    print(f"Checked {numChecked} texts, {numMismatches} mismatches")
+    return numMismatches == 0
+
+# abstracts of the corpus at corpusPath
+def corpusAbstracts(corpusPath):
+    import corpusStore
+    for batch in corpusStore.iterBatches(corpusPath, columns=["Abstract"]):
+        yield from batch["Abstract"]
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import corpusStore
+    corpusPath = sys.argv[1] if len(sys.argv) > 1 else corpusStore.defaultCorpusFile
+    texts = fuzzTexts(20000)
+    ok = checkConformance(lambda: texts)
+
+    if os.path.exists(corpusPath):
+        ok = checkConformance(lambda: corpusAbstracts(corpusPath)) and ok
+    else:
+        # no download yet, check on a generated corpus
+        from benchmark import writeSyntheticCorpus
+        print(f"No {corpusPath}, checking on generated abstracts")
+        with tempfile.TemporaryDirectory() as tmpDir:
+            corpusPath = os.path.join(tmpDir, "syntheticCorpus.parquet")
+            writeSyntheticCorpus(corpusPath, 20000)
+            ok = checkConformance(lambda: corpusAbstracts(corpusPath)) and ok
+    sys.exit(0 if ok else 1)
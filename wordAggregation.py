@@ -0,0 +1,101 @@
+# per year word statistics, built in a single pass over each study
+# memory grows with vocabulary x years (running sums), not with the total number of mentions
+# addStudy is the reference the other counting paths (yearWordMatrix.YearWordCounts, addStudyToPartial, wordIndex) must match,
+# run yearWordMatrix.py to check them
+from collections import Counter
+from array import array
+
+class YearEntry:
+    __slots__ = ("wordDict", "numStudies")
+
+    def __init__(self):
+        self.wordDict = dict()
+        self.numStudies = 0
+
+class WordEntry:
+    __slots__ = ("totalNumMentions", "sumPercentOfStudy", "numStudiesMentioning")
+
+    def __init__(self):
+        self.totalNumMentions = 0
+        self.sumPercentOfStudy = 0.0 #sum over studies mentioning the word of the percent of the study that is this word
+        self.numStudiesMentioning = 0
+
+# add one study (list of words) to studyDict (year -> YearEntry), the reference counting (see yearWordMatrix.checkConformance)
+# numWords is the study's number of words if words only holds some of them (see phraseMatcher)
+def addStudy(studyDict, year, words, wordsWeWant = None, numWords = None):
+    yearArr = studyDict.get(year)
+    if yearArr is None:
+        yearArr = studyDict[year] = YearEntry()
+
+    yearDict = yearArr.wordDict
+    yearArr.numStudies += 1
+    if numWords is None:
+        numWords = len(words)
+
+    # term frequencies once per study, in order of first mention (keeps ties in the output in the same order)
+    for word, count in Counter(words).items():
+        #filter only words we want
+        if wordsWeWant is not None and (word not in wordsWeWant):
+            continue
+
+        wordVal = yearDict.get(word)
+        if wordVal is None:
+            wordVal = yearDict[word] = WordEntry()
+
+        wordVal.totalNumMentions += count
+        #percent of word in respective text
+        wordVal.sumPercentOfStudy += 100.0*count/numWords
+        #count num studies in year mentioning word
+        wordVal.numStudiesMentioning += 1
+
+# tallies of one shard of studies for multi-process counting
+# same as WordEntry but keeps the per study percents in order, so merging shards in order
+# adds them up exactly like the serial run does (float sums depend on order)
+class PartialWordEntry:
+    __slots__ = ("totalNumMentions", "percentsOfStudy")
+
+    def __init__(self):
+        self.totalNumMentions = 0
+        self.percentsOfStudy = array("d")
+
+# add one study to a shard's partialDict (year -> YearEntry of PartialWordEntry)
+def addStudyToPartial(partialDict, year, words, wordsWeWant = None, numWords = None):
+    yearArr = partialDict.get(year)
+    if yearArr is None:
+        yearArr = partialDict[year] = YearEntry()
+
+    yearDict = yearArr.wordDict
+    yearArr.numStudies += 1
+    if numWords is None:
+        numWords = len(words)
+
+    for word, count in Counter(words).items():
+        if wordsWeWant is not None and (word not in wordsWeWant):
+            continue
+
+        wordVal = yearDict.get(word)
+        if wordVal is None:
+            wordVal = yearDict[word] = PartialWordEntry()
+
+        wordVal.totalNumMentions += count
+        wordVal.percentsOfStudy.append(100.0*count/numWords)
+
+# fold a shard's partialDict into studyDict, shards must be merged in input order
+def mergePartial(studyDict, partialDict):
+    for year, partialYear in partialDict.items():
+        yearArr = studyDict.get(year)
+        if yearArr is None:
+            yearArr = studyDict[year] = YearEntry()
+
+        yearDict = yearArr.wordDict
+        yearArr.numStudies += partialYear.numStudies
+
+        for word, partialVal in partialYear.wordDict.items():
+            wordVal = yearDict.get(word)
+            if wordVal is None:
+                wordVal = yearDict[word] = WordEntry()
+
+            wordVal.totalNumMentions += partialVal.totalNumMentions
+            wordVal.numStudiesMentioning += len(partialVal.percentsOfStudy)
+            for percent in partialVal.percentsOfStudy:
+                wordVal.sumPercentOfStudy += percent
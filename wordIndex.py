@@ -0,0 +1,196 @@
+# persistent word count index of the corpus, keyed by pmid (sqlite file)
+# holds each paper's words (as ids) and the per (year, word) totals, so a run after a new download only
+# tokenizes and counts the papers that were added, changed or removed
+# the index is rebuilt from scratch if the tokenizer configuration (filter list, filterNums) changes
+import hashlib
+import sqlite3
+import numpy as np
+from collections import Counter
+from tqdm import tqdm
+import corpusStore
+from wordAggregation import YearEntry, WordEntry
+from tokenCorpus import TokenCorpusBuilder
+
+defaultIndexFile = "wordIndex.sqlite"
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS vocab(id INTEGER PRIMARY KEY, word TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS papers(pmid TEXT PRIMARY KEY, seq INTEGER NOT NULL, contentHash TEXT NOT NULL, year INTEGER, tokens BLOB);
+CREATE TABLE IF NOT EXISTS years(year INTEGER PRIMARY KEY, numStudies INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS yearWords(year INTEGER NOT NULL, wordId INTEGER NOT NULL, firstSeen INTEGER NOT NULL,
+    totalNumMentions INTEGER NOT NULL, sumPercentOfStudy REAL NOT NULL, numStudiesMentioning INTEGER NOT NULL, PRIMARY KEY(year, wordId));
+'''
+
+# WordEntry plus when the word was first seen in its year (keeps ties in the output in the same order as a full run)
+class IndexWordEntry(WordEntry):
+    __slots__ = ("firstSeen",)
+
+# firstSeen of the rank-th distinct word of the paper with sequence number seq
+def firstSeenKey(seq, rank):
+    return (seq << 20) | rank
+
+def contentHash(pubDate, abstract):
+    return hashlib.sha1(f"{pubDate}\0{abstract}".encode()).hexdigest()
+
+class WordIndex:
+    def __init__(self, path, configHash):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+
+        # invalidate if built with a different tokenizer configuration
+        row = self.connection.execute("SELECT value FROM meta WHERE key='configHash'").fetchone()
+        self.rebuilt = row is not None and row[0] != configHash
+        if self.rebuilt:
+            print("Tokenizer configuration changed, rebuilding word index")
+            with self.connection:
+                for table in ("vocab", "papers", "years", "yearWords"):
+                    self.connection.execute(f"DELETE FROM {table}")
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('configHash', ?)", (configHash,))
+
+        self.vocab = [word for (word,) in self.connection.execute("SELECT word FROM vocab ORDER BY id")]
+        self.wordIds = {word: wordId for wordId, word in enumerate(self.vocab)}
+
+        # year -> YearEntry with wordDict of wordId -> IndexWordEntry
+        self.studyDict = dict()
+        for year, numStudies in self.connection.execute("SELECT year, numStudies FROM years"):
+            self.studyDict[year] = YearEntry()
+            self.studyDict[year].numStudies = numStudies
+        for year, wordId, firstSeen, totalNumMentions, sumPercentOfStudy, numStudiesMentioning in self.connection.execute("SELECT * FROM yearWords"):
+            wordVal = self.studyDict[year].wordDict[wordId] = IndexWordEntry()
+            wordVal.firstSeen = firstSeen
+            wordVal.totalNumMentions = totalNumMentions
+            wordVal.sumPercentOfStudy = sumPercentOfStudy
+            wordVal.numStudiesMentioning = numStudiesMentioning
+
+    def close(self):
+        self.connection.close()
+
+    def addToTotals(self, seq, year, ids):
+        yearArr = self.studyDict.get(year)
+        if yearArr is None:
+            yearArr = self.studyDict[year] = YearEntry()
+        yearDict = yearArr.wordDict
+        yearArr.numStudies += 1
+        numWords = len(ids)
+
+        # same arithmetic (and order, papers are added in corpus order) as wordAggregation.addStudy
+        for rank, (wordId, count) in enumerate(Counter(ids).items()):
+            wordVal = yearDict.get(wordId)
+            if wordVal is None:
+                wordVal = yearDict[wordId] = IndexWordEntry()
+                wordVal.firstSeen = firstSeenKey(seq, rank)
+            wordVal.totalNumMentions += count
+            wordVal.sumPercentOfStudy += 100.0*count/numWords
+            wordVal.numStudiesMentioning += 1
+
+    # remove a paper's counts (percent sums and tie order can then differ in the last digits from a fresh build)
+    def removeFromTotals(self, year, ids):
+        yearArr = self.studyDict[year]
+        yearDict = yearArr.wordDict
+        yearArr.numStudies -= 1
+        numWords = len(ids)
+
+        for wordId, count in Counter(ids).items():
+            wordVal = yearDict[wordId]
+            wordVal.totalNumMentions -= count
+            wordVal.sumPercentOfStudy -= 100.0*count/numWords
+            wordVal.numStudiesMentioning -= 1
+            if wordVal.numStudiesMentioning == 0:
+                del yearDict[wordId]
+        if yearArr.numStudies == 0:
+            del self.studyDict[year]
+
+    # apply the difference between the index and the corpus
+    # parseStudy(pubDate, abstract) gives {"year", "words"} or None (like databaseWordCounter.parseStudy)
+    def update(self, corpusPath, parseStudy):
+        cursor = self.connection.execute("SELECT pmid, contentHash FROM papers")
+        indexedHashes = dict(cursor.fetchall())
+        nextSeq = (self.connection.execute("SELECT MAX(seq) FROM papers").fetchone()[0] or 0) + 1
+        numVocab = len(self.vocab)
+
+        newPapers = []
+        removedPmids = set(indexedHashes)
+        numChanged = 0
+
+        with tqdm(total=corpusStore.numRows(corpusPath), desc="Updating word index", leave=True) as progress:
+            for batch in corpusStore.iterBatches(corpusPath, columns=["PMID", "pubDate", "Abstract"]):
+                for pmid, pubDate, abstract in zip(batch["PMID"], batch["pubDate"], batch["Abstract"]):
+                    paperHash = contentHash(pubDate, abstract)
+                    oldHash = indexedHashes.get(pmid)
+                    if oldHash == paperHash:
+                        removedPmids.discard(pmid)
+                        continue
+                    if oldHash is not None:
+                        numChanged += 1 #removed below, then added again
+
+                    study = parseStudy(pubDate, abstract)
+                    year = None
+                    tokens = None
+                    if study is not None:
+                        year = study["year"]
+                        ids = [self.wordIds.setdefault(word, len(self.wordIds)) for word in study["words"]]
+                        self.addToTotals(nextSeq, year, ids)
+                        tokens = np.array(ids, dtype=np.int32).tobytes()
+                    newPapers.append((pmid, nextSeq, paperHash, year, tokens))
+                    indexedHashes[pmid] = paperHash
+                    nextSeq += 1
+                progress.update(len(batch["PMID"]))
+
+        # changed papers are in removedPmids too (their old rows were never matched)
+        removed = list(removedPmids)
+        for pmid in removed:
+            year, tokens = self.connection.execute("SELECT year, tokens FROM papers WHERE pmid=?", (pmid,)).fetchone()
+            if year is not None:
+                self.removeFromTotals(year, np.frombuffer(tokens, dtype=np.int32).tolist())
+
+        # ids were given out in insertion order
+        self.vocab.extend(list(self.wordIds)[numVocab:])
+
+        if newPapers or removed:
+            with self.connection:
+                self.connection.executemany("DELETE FROM papers WHERE pmid=?", [(pmid,) for pmid in removed])
+                self.connection.executemany("INSERT INTO papers VALUES (?,?,?,?,?)", newPapers)
+                self.connection.executemany("INSERT INTO vocab VALUES (?,?)", [(wordId, self.vocab[wordId]) for wordId in range(numVocab, len(self.vocab))])
+                self.saveTotals()
+
+        return {"index_papers_added": len(newPapers)-numChanged, "index_papers_changed": numChanged,
+                "index_papers_removed": len(removed)-numChanged, "index_rebuilt_for_new_tokenizer_config": self.rebuilt}
+
+    def saveTotals(self):
+        self.connection.execute("DELETE FROM years")
+        self.connection.execute("DELETE FROM yearWords")
+        self.connection.executemany("INSERT INTO years VALUES (?,?)", [(year, yearArr.numStudies) for year, yearArr in self.studyDict.items()])
+        self.connection.executemany("INSERT INTO yearWords VALUES (?,?,?,?,?,?)",
+            ((year, wordId, wordVal.firstSeen, wordVal.totalNumMentions, wordVal.sumPercentOfStudy, wordVal.numStudiesMentioning)
+             for year, yearArr in self.studyDict.items() for wordId, wordVal in yearArr.wordDict.items()))
+
+    def numStudies(self):
+        return sum(yearArr.numStudies for yearArr in self.studyDict.values())
+
+    # studyDict keyed by word like wordAggregation.addStudy of each paper gives, for pipeline1
+    def getStudyDict(self, wordsWeWant = None):
+        studyDict = dict()
+        for year, indexYear in self.studyDict.items():
+            yearArr = studyDict[year] = YearEntry()
+            yearArr.numStudies = indexYear.numStudies
+            for wordId, indexVal in sorted(indexYear.wordDict.items(), key=lambda item: item[1].firstSeen):
+                word = self.vocab[wordId]
+                if wordsWeWant is not None and (word not in wordsWeWant):
+                    continue
+                wordVal = yearArr.wordDict[word] = WordEntry()
+                wordVal.totalNumMentions = indexVal.totalNumMentions
+                wordVal.sumPercentOfStudy = indexVal.sumPercentOfStudy
+                wordVal.numStudiesMentioning = indexVal.numStudiesMentioning
+        return studyDict
+
+    # papers with a year and abstract in corpus order as a TokenCorpus over the index's vocabulary (for outputYearWord)
+    def tokenCorpus(self):
+        builder = TokenCorpusBuilder()
+        builder.vocab = self.wordIds
+        for year, tokens in self.connection.execute("SELECT year, tokens FROM papers WHERE year IS NOT NULL ORDER BY seq"):
+            ids = np.frombuffer(tokens, dtype=np.int32)
+            builder.addStudy(year, ids, len(ids))
+        return builder.finish()
@@ -0,0 +1,237 @@
+# sparse year x word matrix of the aggregated counts, and the wordcount.csv writer built on it
+# rows are years, each row's entries are kept in the order words were first seen in that year (keeps ties in the same order)
+# built from a studyDict (see wordAggregation) or straight from the word ids of a TokenCorpus
+import sys
+import csv
+import numpy as np
+
+colTitles = ["word","number of mentions","Avg percent of mentions per study","percent of studies in year mentioning word"]
+
+class YearWordMatrix:
+    # years: sorted int array, numStudies: studies per year
+    # yearPtr: entries of year i are yearPtr[i]:yearPtr[i+1] in wordIds/totalNumMentions/numStudiesMentioning/sumPercentOfStudy
+    # vocab: list of words (wordIds index into it)
+    def __init__(self, years, numStudies, yearPtr, wordIds, totalNumMentions, numStudiesMentioning, sumPercentOfStudy, vocab):
+        self.years = years
+        self.numStudies = numStudies
+        self.yearPtr = yearPtr
+        self.wordIds = wordIds
+        self.totalNumMentions = totalNumMentions
+        self.numStudiesMentioning = numStudiesMentioning
+        self.sumPercentOfStudy = sumPercentOfStudy
+        self.vocab = vocab
+
+    # from a studyDict (year -> YearEntry, see wordAggregation)
+    @classmethod
+    def fromStudyDict(cls, studyDict):
+        wordIdOf = dict()
+        sortedYears = sorted(studyDict.items(), key=lambda item: int(item[0]))
+        numEntries = sum(len(yearArr.wordDict) for _, yearArr in sortedYears)
+
+        yearPtr = np.zeros(len(sortedYears)+1, dtype=np.int64)
+        wordIds = np.empty(numEntries, dtype=np.int64)
+        totalNumMentions = np.empty(numEntries, dtype=np.int64)
+        numStudiesMentioning = np.empty(numEntries, dtype=np.int64)
+        sumPercentOfStudy = np.empty(numEntries, dtype=np.float64)
+
+        pos = 0
+        for yearInd, (_, yearArr) in enumerate(sortedYears):
+            for word, wordVal in yearArr.wordDict.items():
+                wordIds[pos] = wordIdOf.setdefault(word, len(wordIdOf))
+                totalNumMentions[pos] = wordVal.totalNumMentions
+                numStudiesMentioning[pos] = wordVal.numStudiesMentioning
+                sumPercentOfStudy[pos] = wordVal.sumPercentOfStudy
+                pos += 1
+            yearPtr[yearInd+1] = pos
+
+        years = np.array([year for year, _ in sortedYears], dtype=np.int64)
+        numStudies = np.array([yearArr.numStudies for _, yearArr in sortedYears], dtype=np.int64)
+        return cls(years, numStudies, yearPtr, wordIds, totalNumMentions, numStudiesMentioning, sumPercentOfStudy, list(wordIdOf))
+
+    # from a TokenCorpus, counted on word ids a block of studies at a time, only words in wordsWeWant if it is given
+    # gives the same values and order as fromStudyDict does after wordAggregation.addStudy of each study in turn
+    @classmethod
+    def fromTokenCorpus(cls, corpus, wordsWeWant = None, blockTokens = 1000000):
+        years, yearIndex, numStudies = corpus.yearGroups()
+        wanted = corpus.wordMask(wordsWeWant)
+        counts = YearWordCounts(len(corpus.vocab))
+        for start, end, tokens, studyOfToken in corpus.iterBlocks(blockTokens):
+            keep = wanted[tokens]
+            counts.addMentions(studyOfToken[keep], tokens[keep], yearIndex[start:end], np.asarray(corpus.numWords[start:end]))
+        return counts.toMatrix(years, numStudies, corpus.vocab)
+
+    # entries of one year sorted by number of mentions (stable, so ties keep first seen order)
+    def yearOrder(self, yearInd):
+        start, end = self.yearPtr[yearInd], self.yearPtr[yearInd+1]
+        return start + np.argsort(-self.totalNumMentions[start:end], kind="stable")
+
+    # the 4 output columns of the given entries of one year, as python lists
+    def formatEntries(self, yearInd, entries):
+        numStudies = self.numStudies[yearInd]
+        vocab = self.vocab
+        words = [vocab[wordId] for wordId in self.wordIds[entries].tolist()]
+        #for average, divide by number of studies in group (not numStudiesMentioning since studies not mentioning the word add 0%)
+        avgPercentMentionsPerStudy = np.char.add((self.sumPercentOfStudy[entries]/numStudies).astype(str), "%")
+        percentStudiesMentioningWord = np.char.add((100*self.numStudiesMentioning[entries]/numStudies).astype(str), "%")
+        return words, self.totalNumMentions[entries].tolist(), avgPercentMentionsPerStudy.tolist(), percentStudiesMentioningWord.tolist()
+
+    # write the wide wordcount csv (4 columns per year, words sorted by mentions)
+    # rows are formatted a block at a time, so only blockSize rows of strings exist at once
+    def writeWordcountCsv(self, path, blockSize = 2000):
+        numYears = len(self.years)
+        orders = [self.yearOrder(yearInd) for yearInd in range(numYears)]
+        numRows = max((len(order) for order in orders), default=0)
+        blank = ["", "", "", ""]
+
+        with open(path, 'w', newline='', encoding="utf-8-sig") as fp:
+            writer = csv.writer(fp, quoting=csv.QUOTE_NONNUMERIC)
+
+            #titles
+            row = []
+            for yearInd in range(numYears):
+                row += [int(self.years[yearInd]), "Num studies:"+str(self.numStudies[yearInd]), "", ""]
+            writer.writerow(row)
+            writer.writerow(colTitles*numYears)
+
+            #values
+            for blockStart in range(0, numRows, blockSize):
+                blockEnd = min(blockStart+blockSize, numRows)
+                columns = [self.formatEntries(yearInd, order[blockStart:blockEnd]) for yearInd, order in enumerate(orders)]
+                for rowInd in range(blockEnd-blockStart):
+                    row = []
+                    for words, mentions, avgPercents, studyPercents in columns:
+                        if rowInd < len(words):
+                            row += [words[rowInd], mentions[rowInd], avgPercents[rowInd], studyPercents[rowInd]]
+                        else:
+                            row += blank
+                    writer.writerow(row)
+
+# running (year, word) tallies of word ids, added a block of studies at a time in study order (see YearWordMatrix.fromTokenCorpus)
+# kept as flat arrays sorted by key = yearIndex*numWordIds + wordId, with when each entry was first seen to order the years' entries
+class YearWordCounts:
+    def __init__(self, numWordIds):
+        self.numWordIds = max(numWordIds, 1)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.totalNumMentions = np.empty(0, dtype=np.int64)
+        self.numStudiesMentioning = np.empty(0, dtype=np.int64)
+        self.sumPercentOfStudy = np.empty(0, dtype=np.float64)
+        self.firstSeen = np.empty(0, dtype=np.int64) #number of (study, word) pairs before the entry's first one
+        self.numPairs = 0
+
+    # the mentions of a block of studies: study (index in the block) and word id of each, in order within each study
+    # yearIndex and numWords (the denominator of the percents) are per study of the block
+    def addMentions(self, studies, wordIds, yearIndex, numWords):
+        numWordIds = self.numWordIds
+
+        # distinct words of each study with their count, in order of first mention (like Counter in addStudy)
+        pairKeys, firstIndex, counts = np.unique(studies.astype(np.int64)*numWordIds + wordIds, return_index=True, return_counts=True)
+        order = np.argsort(firstIndex)
+        pairKeys = pairKeys[order]
+        counts = counts[order]
+        pairStudy = pairKeys//numWordIds
+        percents = 100.0*counts/numWords[pairStudy]
+
+        # the block's entries, new ones are inserted into the running ones
+        blockKeys, blockFirst, blockInverse = np.unique(yearIndex[pairStudy].astype(np.int64)*numWordIds + pairKeys%numWordIds, return_index=True, return_inverse=True)
+        positions = np.searchsorted(self.keys, blockKeys)
+        isNew = positions >= len(self.keys)
+        isNew[~isNew] = self.keys[positions[~isNew]] != blockKeys[~isNew]
+        newPositions = positions[isNew]
+        self.keys = np.insert(self.keys, newPositions, blockKeys[isNew])
+        self.totalNumMentions = np.insert(self.totalNumMentions, newPositions, 0)
+        self.numStudiesMentioning = np.insert(self.numStudiesMentioning, newPositions, 0)
+        self.sumPercentOfStudy = np.insert(self.sumPercentOfStudy, newPositions, 0.0)
+        self.firstSeen = np.insert(self.firstSeen, newPositions, self.numPairs + blockFirst[isNew])
+
+        entries = np.searchsorted(self.keys, blockKeys)
+        numBlockEntries = len(blockKeys)
+        self.totalNumMentions[entries] += np.bincount(blockInverse, weights=counts, minlength=numBlockEntries).astype(np.int64)
+        self.numStudiesMentioning[entries] += np.bincount(blockInverse, minlength=numBlockEntries)
+        # bincount adds in input order, so putting each entry's running sum first adds the percents exactly like the serial sums
+        self.sumPercentOfStudy[entries] = np.bincount(np.concatenate([np.arange(numBlockEntries), blockInverse]),
+                                                      weights=np.concatenate([self.sumPercentOfStudy[entries], percents]), minlength=numBlockEntries)
+        self.numPairs += len(pairKeys)
+
+    # years: sorted years the yearIndex of addMentions points into, numStudies: studies per year, vocab: list of words of the word ids
+    def toMatrix(self, years, numStudies, vocab):
+        # entries of each year in the order they were first seen
+        entryYears = self.keys//self.numWordIds
+        order = np.lexsort((self.firstSeen, entryYears))
+        yearPtr = np.zeros(len(years)+1, dtype=np.int64)
+        yearPtr[1:] = np.cumsum(np.bincount(entryYears, minlength=len(years)))
+        return YearWordMatrix(np.asarray(years, dtype=np.int64), np.asarray(numStudies, dtype=np.int64), yearPtr, self.keys[order]%self.numWordIds,
+                              self.totalNumMentions[order], self.numStudiesMentioning[order], self.sumPercentOfStudy[order], vocab)
+
+# whether two matrices hold the same entries in the same order (sums compared exactly)
+def sameCounts(matrix, other):
+    arrays = ("years", "numStudies", "yearPtr", "totalNumMentions", "numStudiesMentioning", "sumPercentOfStudy")
+    return (all(np.array_equal(getattr(matrix, name), getattr(other, name)) for name in arrays)
+            and [matrix.vocab[wordId] for wordId in matrix.wordIds.tolist()] == [other.vocab[wordId] for wordId in other.wordIds.tolist()])
+
+# check the counting paths against wordAggregation.addStudy (the reference) on every study of the corpus, with all words and with some:
+# fromTokenCorpus (serial run, also in small blocks), addStudyToPartial + mergePartial (--workers) and WordIndex (--useIndex)
+def checkConformance(corpusPath):
+    import os
+    import tempfile
+    import corpusStore
+    import wordAggregation
+    from tokenizer import Tokenizer
+    from wordIndex import WordIndex
+    from databaseWordCounter import parseStudy, buildTokenCorpus
+    from wordsToFilterList import wordsToFilterList
+
+    tokenizer = Tokenizer(True, set(Tokenizer(True).tokenize(wordsToFilterList)))
+    rows = [row for batch in corpusStore.iterBatches(corpusPath, columns=["pubDate","Abstract"]) for row in zip(batch["pubDate"], batch["Abstract"])]
+    studies = [study for study in (parseStudy(pubDate, abstract, tokenizer) for pubDate, abstract in rows) if study is not None]
+    corpus = buildTokenCorpus(rows, tokenizer)
+
+    numChecked = 0
+    numMismatches = 0
+    for wordsWeWant in (None, set(corpus.vocab[::50])):
+        reference = dict()
+        for study in studies:
+            wordAggregation.addStudy(reference, study["year"], study["words"], wordsWeWant, study["numWords"])
+        reference = YearWordMatrix.fromStudyDict(reference)
+
+        candidates = dict()
+        candidates["fromTokenCorpus"] = YearWordMatrix.fromTokenCorpus(corpus, wordsWeWant)
+        candidates["fromTokenCorpus in small blocks"] = YearWordMatrix.fromTokenCorpus(corpus, wordsWeWant, blockTokens=1000)
+
+        studyDict = dict()
+        for shardStart in range(0, len(studies), 500):
+            partialDict = dict()
+            for study in studies[shardStart:shardStart+500]:
+                wordAggregation.addStudyToPartial(partialDict, study["year"], study["words"], wordsWeWant, study["numWords"])
+            wordAggregation.mergePartial(studyDict, partialDict)
+        candidates["mergePartial"] = YearWordMatrix.fromStudyDict(studyDict)
+
+        with tempfile.TemporaryDirectory() as tmpDir:
+            index = WordIndex(os.path.join(tmpDir, "wordIndex.sqlite"), tokenizer.configHash())
+            index.update(corpusPath, lambda pubDate, abstract: parseStudy(pubDate, abstract, tokenizer))
+            candidates["WordIndex"] = YearWordMatrix.fromStudyDict(index.getStudyDict(wordsWeWant))
+            index.close()
+
+        for name, matrix in candidates.items():
+            numChecked += 1
+            if not sameCounts(matrix, reference):
+                numMismatches += 1
+                print("Mismatch:", name, "with all words" if wordsWeWant is None else "with some words")
+
+    print(f"Checked {numChecked} counts of {len(studies)} studies, {numMismatches} mismatches")
+    return numMismatches == 0
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import corpusStore
+    corpusPath = sys.argv[1] if len(sys.argv) > 1 else corpusStore.defaultCorpusFile
+    if os.path.exists(corpusPath):
+        sys.exit(0 if checkConformance(corpusPath) else 1)
+
+    # no download yet, check on a generated corpus
+    from benchmark import writeSyntheticCorpus
+    print(f"No {corpusPath}, checking on generated abstracts")
+    with tempfile.TemporaryDirectory() as tmpDir:
+        corpusPath = os.path.join(tmpDir, "syntheticCorpus.parquet")
+        writeSyntheticCorpus(corpusPath, 20000)
+        sys.exit(0 if checkConformance(corpusPath) else 1)
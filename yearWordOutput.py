@@ -0,0 +1,75 @@
+# output files of yearWordMode (each word with the year it showed up in)
+# rows: raw_word_year.csv, a [year, word] row per word of every study, written a study (or a block of a TokenCorpus) at a time
+# counts/parquet: one (year, word, count) row per distinct word in each year, as csv or a compressed columnar file
+import os
+import csv
+import numpy as np
+from tqdm import tqdm
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+yearWordFormats = ("rows", "counts", "parquet")
+
+countsSchema = pa.schema([("year", pa.int32()), ("word", pa.string()), ("count", pa.int64())])
+
+# streams raw_word_year.csv to disk, rows are never all held in memory
+class YearWordWriter:
+    def __init__(self, outputDir, wordsWeWant = None):
+        self.wordsWeWant = wordsWeWant
+        self.fp = open(os.path.join(outputDir,'raw_word_year.csv'), 'w', newline='', encoding="utf-8-sig")
+        self.writer = csv.writer(self.fp, quoting=csv.QUOTE_NONNUMERIC)
+        self.writer.writerow(["year","word"])
+
+    # study is {"year", "words"} (see databaseWordCounter.parseStudy)
+    def writeStudy(self, study):
+        year = study["year"]
+        wordsWeWant = self.wordsWeWant
+        #filter only words we want
+        self.writer.writerows([year, word] for word in study["words"] if wordsWeWant is None or word in wordsWeWant)
+
+    def writeStudies(self, studies):
+        for study in studies:
+            self.writeStudy(study)
+
+    # every study of a TokenCorpus, the words we want are picked by id and the rows built a block of studies at a time
+    def writeTokenCorpus(self, corpus, blockTokens = 1000000):
+        vocab = np.array(corpus.vocab, dtype=object)
+        wanted = corpus.wordMask(self.wordsWeWant)
+        for start, end in tqdm(list(corpus.studyBlocks(blockTokens)), desc="Saving raw_word_year.csv", leave=True):
+            tokens, studyOfToken = corpus.blockTokens(start, end)
+            keep = wanted[tokens]
+            years = np.asarray(corpus.years[start:end])[studyOfToken[keep]]
+            self.writer.writerows(zip(years.tolist(), vocab[tokens[keep]].tolist()))
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+# the (year, word, count) triples from a YearWordMatrix, years in order and words in the order they were first seen
+# counts are the matrix's totalNumMentions, i.e. the number of raw_word_year.csv rows with that year and word
+def writeYearWordCounts(matrix, outputDir, fileFormat = "counts"):
+    def yearEntries():
+        for yearInd, year in enumerate(matrix.years.tolist()):
+            start, end = matrix.yearPtr[yearInd], matrix.yearPtr[yearInd+1]
+            yield year, [matrix.vocab[wordId] for wordId in matrix.wordIds[start:end].tolist()], matrix.totalNumMentions[start:end].tolist()
+
+    if fileFormat == "counts":
+        with open(os.path.join(outputDir,'raw_word_year_counts.csv'), 'w', newline='', encoding="utf-8-sig") as fp:
+            writer = csv.writer(fp, quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow(["year","word","count"])
+            for year, words, counts in yearEntries():
+                writer.writerows([year, word, count] for word, count in zip(words, counts))
+
+    elif fileFormat == "parquet":
+        #a row group per year
+        with pq.ParquetWriter(os.path.join(outputDir,'raw_word_year_counts.parquet'), countsSchema, compression="zstd") as writer:
+            for year, words, counts in yearEntries():
+                writer.write_table(pa.table({"year": [year]*len(words), "word": words, "count": counts}, schema=countsSchema))
+
+    else:
+        raise Exception(f"Unknown yearWord format '{fileFormat}', expected one of {yearWordFormats}")